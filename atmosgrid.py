@@ -0,0 +1,530 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import multiprocessing
+from multiprocessing import sharedctypes
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from const import *
+import common
+import tile
+
+GAS_FIELDS = ["pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins", "heat_lvl"]
+
+# the array types in GridEngine.static, bar the per-tile list at the end
+STATIC_TYPES = "dddbbbb"
+
+def available():
+	return numpy != None
+
+class GridEngine:
+	# runs one tick_full-equivalent atmos pass over the whole grid at once,
+	# see stencil() below.
+	#
+	# tiles with directional behaviour (pumps) don't fit the stencil,
+	# so they're cut out of it and get the regular per-tile update afterwards.
+	# the tiles next to them can't see them properly from inside the stencil either,
+	# so those only take gas in the stencil and push theirs per tile too.
+	def __init__(self, world):
+		assert numpy != None, "GridEngine needs numpy"
+		self.world = world
+		self.static = None
+		self.dirty = [] # rects whose tiles changed since static was worked out
+		self.residual = 0.0 # how much pressure moved around last tick
+		
+		# what's already been added to the world's dirty_tiles, and which set that was
+		self.marked = None
+		self.marked_set = None
+	
+	def invalidate(self):
+		self.static = None
+		self.dirty = []
+	
+	def invalidate_rect(self, x0, y0, x1, y1):
+		# only the tiles in x0,y0-x1,y1 changed
+		if self.static != None:
+			self.dirty.append((x0, y0, x1, y1))
+	
+	def view(self, name):
+		w = self.world
+		return numpy.frombuffer(getattr(w, name), dtype=numpy.float64).reshape(w.h, w.w)
+	
+	def build_static(self):
+		w = self.world
+		self.tile_static = (
+			numpy.zeros((w.h, w.w)), # pres_tol_min
+			numpy.zeros((w.h, w.w)), # pres_tol_max
+			numpy.zeros((w.h, w.w)), # pres_tol_leakmax
+			numpy.zeros((w.h, w.w), dtype=bool), # broken
+			numpy.zeros((w.h, w.w), dtype=bool), # atmos_sink
+			numpy.zeros((w.h, w.w), dtype=bool), # atmos_frozen
+			numpy.zeros((w.h, w.w), dtype=bool), # pumps
+		)
+		self.dirty = []
+		self.read_tiles(0, 0, w.w, w.h)
+		self.derive_static()
+	
+	def update_static(self):
+		for x0, y0, x1, y1 in self.dirty:
+			self.read_tiles(x0, y0, x1, y1)
+		self.dirty = []
+		self.derive_static()
+	
+	def read_tiles(self, x0, y0, x1, y1):
+		tol_min, tol_max, tol_leak, broken, sink, frozen, pump = self.tile_static
+		g = self.world.g
+		flow = self.view("pres_flow")
+		for y in xrange(y0, y1):
+			row = g[y]
+			for x in xrange(x0, x1):
+				t = row[x]
+				if t.world == None:
+					# the shared tiles keep nothing in the arrays,
+					# the stencil still needs to know how much flows into them
+					flow[y,x] = t.pres_flow
+				tol_min[y,x] = t.pres_tol_min
+				tol_max[y,x] = t.pres_tol_max
+				tol_leak[y,x] = t.pres_tol_leakmax
+				broken[y,x] = t.broken
+				sink[y,x] = t.atmos_sink
+				frozen[y,x] = t.atmos_frozen
+				pump[y,x] = isinstance(t, tile.PumpTile)
+	
+	def derive_static(self):
+		# everything that depends on a tile's neighbours is worked out here,
+		# which is cheap enough to just do for the whole grid
+		tol_min, tol_max, tol_leak, broken, sink, frozen, pump = self.tile_static
+		special = pump | frozen
+		
+		near = numpy.zeros_like(pump)
+		near[1:,:] |= pump[:-1,:]
+		near[:-1,:] |= pump[1:,:]
+		near[:,1:] |= pump[:,:-1]
+		near[:,:-1] |= pump[:,1:]
+		coupled = pump | (near & ~sink & ~frozen)
+		
+		# the border and deep space never push gas anywhere, and swallow what they get
+		active = ~special & ~sink & ~coupled
+		
+		ys, xs = numpy.nonzero(coupled)
+		per_tile = zip(xs.tolist(), ys.tolist())
+		
+		self.static = (tol_min, tol_max, tol_leak, broken, special, active, sink, per_tile)
+	
+	def break_tiles(self, broke):
+		ys, xs = numpy.nonzero(broke)
+		for x, y in zip(xs.tolist(), ys.tolist()):
+			self.world.g[y][x].become_broken()
+	
+	def mark_dirty(self, touched):
+		# the world only ever swaps dirty_tiles for a new set once it's saved them,
+		# until then just add what isn't in there already
+		w = self.world
+		if self.marked_set is not w.dirty_tiles:
+			self.marked = numpy.zeros((w.h, w.w), dtype=bool)
+			self.marked_set = w.dirty_tiles
+		
+		new = touched & ~self.marked
+		self.marked |= touched
+		w.dirty_tiles.update(numpy.flatnonzero(new).tolist())
+	
+	def copy_shared_arrays(self):
+		# copies of whichever of the world's arrays are shared with anyone else, by name
+		return {}
+	
+	def step(self):
+		# moves the world's gas on, and marks what changed dirty.
+		# returns what got touched and what broke, and sets residual.
+		gas = [self.view(k) for k in GAS_FIELDS]
+		out, touched, broke, moved = grid_step(gas, self.view("pres_flow"), self.static[:-1])
+		for g, ng in zip(gas, out):
+			g[...] = ng
+		self.mark_dirty(touched)
+		self.residual = float(moved.sum())
+		return touched, broke
+	
+	def tick(self):
+		w = self.world
+		if self.static == None:
+			self.build_static()
+		elif self.dirty:
+			self.update_static()
+		
+		per_tile = self.static[-1]
+		touched, broke = self.step()
+		self.break_tiles(broke)
+		
+		for x, y in per_tile:
+			w.g[y][x].update_atmos_pres()
+			touched[y,x] = True
+			for u,v in DIR_LIST_NSWE:
+				touched[y+v,x+u] = True
+		
+		return touched
+
+class ParallelGridEngine(GridEngine):
+	# same as GridEngine, but the step runs on strips of rows in a process pool.
+	# the step only ever reads the old state and writes the new state,
+	# so strips can't race each other. each worker reads two halo rows
+	# from its neighbours straight out of the shared input buffers.
+	#
+	# while we're around, the world keeps its gas and flow in shared memory,
+	# so the workers work straight off it. there are two sets of gas arrays,
+	# each tick reads the world's set and writes the other, which then becomes the world's.
+	# the workers mark what they touch dirty as well, in a shared copy of marked.
+	# the static arrays only get copied over when they change.
+	# the pumps still get updated per tile in here afterwards.
+	def __init__(self, world, procs=None):
+		GridEngine.__init__(self, world)
+		self.procs = procs or multiprocessing.cpu_count()
+		
+		n = world.w*world.h
+		self.shm = (
+			[[sharedctypes.RawArray("d", n) for k in GAS_FIELDS] for s in xrange(2)],
+			sharedctypes.RawArray("d", n), # pres_flow
+			[sharedctypes.RawArray(tc, n) for tc in STATIC_TYPES],
+			sharedctypes.RawArray("b", n), # touched
+			sharedctypes.RawArray("b", n), # marked
+		)
+		self.shared_static = None # which static is in shm
+		
+		self.gas_set = 0 # which set of gas arrays is the world's
+		self.set_world_arrays(GAS_FIELDS, self.shm[0][0])
+		self.set_world_arrays(["pres_flow"], [self.shm[1]])
+		
+		h = world.h
+		self.strips = [(h*j//self.procs, h*(j+1)//self.procs) for j in xrange(self.procs)]
+		self.strips = [(y0, y1) for (y0, y1) in self.strips if y1 > y0]
+		
+		# the workers get forked off with the shared buffers already in place
+		self.pool = multiprocessing.Pool(self.procs, _worker_init, (world.w, world.h, self.shm))
+	
+	def close(self):
+		self.pool.terminate()
+		self.pool.join()
+		
+		# the world gets memory of its own back
+		for k, a in self.copy_shared_arrays().iteritems():
+			setattr(self.world, k, a)
+	
+	def set_world_arrays(self, names, arrays):
+		w = self.world
+		for k, a in zip(names, arrays):
+			copy_array(a, getattr(w, k))
+			setattr(w, k, a)
+	
+	def copy_shared_arrays(self):
+		w = self.world
+		copies = {}
+		for k in GAS_FIELDS+["pres_flow"]:
+			a = common.lazy_array("d", w.w*w.h)
+			copy_array(a, getattr(w, k))
+			copies[k] = a
+		
+		return copies
+	
+	def step(self):
+		w = self.world
+		gas_sets, flow, static_in, touched, marked = _shared_views(w.w, w.h, self.shm)
+		
+		if self.shared_static is not self.static:
+			for a, v in zip(static_in, self.static[:-1]):
+				a[...] = v
+			self.shared_static = self.static
+		if self.marked_set is not w.dirty_tiles:
+			marked[...] = False
+			self.marked_set = w.dirty_tiles
+		
+		broke = numpy.zeros((w.h, w.w), dtype=bool)
+		self.residual = 0.0
+		for idx, new, moved in self.pool.map(_strip_step, [(y0, y1, self.gas_set) for (y0, y1) in self.strips]):
+			broke.flat[idx] = True
+			w.dirty_tiles.update(new)
+			self.residual += moved
+		
+		# the workers wrote the new gas over the other set
+		self.gas_set = 1-self.gas_set
+		for k, a in zip(GAS_FIELDS, self.shm[0][self.gas_set]):
+			setattr(w, k, a)
+		
+		return touched, broke
+
+class ZoneSolver:
+	# jumps a zone straight to where its gas would end up, instead of
+	# waiting the O(diameter^2) ticks the explicit update takes to get there.
+	#
+	# this is a backward Euler step over some number of ticks:
+	#   (I + ticks*L) x = x0
+	# where L is the graph Laplacian of the zone, with each pair of tiles
+	# exchanging 2*ATMOS_FLOW_ADJUST/5 * (both of their flows) per tick.
+	# that's what the per-tile update comes to once the gas has smoothed out a bit,
+	# both tiles move gas between them in their own updates.
+	# deep space next to the zone acts as a fixed vacuum.
+	# L is symmetric, so this is solved with Jacobi-preconditioned CG,
+	# all four gas fields at once.
+	# pumps aren't part of the solve, they carry on per tile afterwards.
+	def __init__(self, world):
+		assert numpy != None, "ZoneSolver needs numpy"
+		self.world = world
+	
+	def build(self, tiles):
+		# returns tile indices, neighbour slots (len(tiles) = none), weights, sink weights
+		w = self.world
+		idx = sorted(tiles)
+		slot = dict((i, k) for k, i in enumerate(idx))
+		n = len(idx)
+		offs = (-w.w, w.w, -1, 1)
+		flow = w.pres_flow
+		
+		nbr = numpy.empty((n, 4), dtype=numpy.intp)
+		nbr.fill(n)
+		wt = numpy.zeros((n, 4))
+		sw = numpy.zeros(n)
+		for k, i in enumerate(idx):
+			for d, o in enumerate(offs):
+				j = i+o
+				if j in slot:
+					nbr[k,d] = slot[j]
+					wt[k,d] = flow[i]*flow[j]*ATMOS_FLOW_ADJUST*2.0/5.0
+				else:
+					# this can be the void, which keeps nothing in the arrays
+					t = w.g[j//w.w][j%w.w]
+					if t.atmos_sink:
+						sw[k] += flow[i]*t.pres_flow*ATMOS_FLOW_ADJUST*2.0/5.0
+		
+		return numpy.array(idx, dtype=numpy.intp), nbr, wt, sw
+	
+	def solve(self, tiles, ticks=None):
+		# ticks=None solves for where the zone ends up for good.
+		# a sealed zone just ends up uniform, and keeps every last bit of its gas.
+		# a zone open to space ends up empty, which isn't worth skipping ahead to,
+		# so that's left alone. returns False if nothing was done.
+		w = self.world
+		idx, nbr, wt, sw = self.build(tiles)
+		n = len(idx)
+		sealed = not sw.any()
+		if ticks == None and not sealed:
+			return False
+		
+		flat = [numpy.frombuffer(getattr(w, k), dtype=numpy.float64) for k in GAS_FIELDS]
+		b = numpy.column_stack([a[idx] for a in flat])
+		
+		if ticks == None:
+			x = numpy.tile(b.sum(axis=0)/n, (n, 1))
+		else:
+			dt = float(ticks)
+			deg = wt.sum(axis=1)+sw
+			x = self.cg(b, nbr, wt*dt, 1.0+deg*dt)
+			if sealed:
+				# CG only gets the totals right to within its tolerance
+				x += (b.sum(axis=0)-x.sum(axis=0))/n
+		
+		x[x < ATMOS_MIN_PRESSURE] = 0.0
+		for a, col in zip(flat, x.T):
+			a[idx] = col
+		w.dirty_tiles.update(idx.tolist())
+		
+		return True
+	
+	def cg(self, b, nbr, wt, diag):
+		n = len(b)
+		pad = numpy.zeros((1, b.shape[1]))
+		
+		def mul(v):
+			vp = numpy.vstack((v, pad))
+			r = v*diag[:,None]
+			for d in xrange(4):
+				r -= wt[:,d,None]*vp[nbr[:,d]]
+			return r
+		
+		def div(a, c):
+			return numpy.where(c != 0.0, a/numpy.where(c != 0.0, c, 1.0), 0.0)
+		
+		x = b.copy()
+		r = b-mul(x)
+		z = r/diag[:,None]
+		p = z.copy()
+		rz = (r*z).sum(axis=0)
+		tol = (ATMOS_SOLVE_TOLERANCE*numpy.sqrt((b*b).sum(axis=0)))**2
+		
+		for it in xrange(ATMOS_SOLVE_MAX_ITER):
+			if ((r*r).sum(axis=0) <= tol).all():
+				break
+			
+			ap = mul(p)
+			alpha = div(rz, (p*ap).sum(axis=0))
+			x += alpha*p
+			r -= alpha*ap
+			z = r/diag[:,None]
+			nrz = (r*z).sum(axis=0)
+			p = z+div(nrz, rz)*p
+			rz = nrz
+		
+		return x
+
+def copy_array(dst, src):
+	# between two flat arrays of doubles of the same size, of whatever kind
+	numpy.frombuffer(dst, dtype=numpy.float64)[...] = numpy.frombuffer(src, dtype=numpy.float64)
+
+def stress(p, f, tol_min, tol_max, tol_leak, broken):
+	# same as Tile.stress, for a block of tiles
+	ptf = p*(1.0-f)
+	leak = (ptf-tol_min)*(tol_leak-f)/(tol_max-tol_min)+f
+	f = numpy.where(ptf > tol_min, leak, f)
+	return numpy.where(broken, 1.0, f)
+
+def grid_step(gas, flow, static):
+	# one GridEngine tick over a block of rows, which needs the same halo as stencil().
+	# whatever breaks this tick already counts as broken for it,
+	# the tiles themselves get broken afterwards by whoever called this.
+	# returns the new gas arrays, which tiles got touched, which ones broke,
+	# and how much each tile's pressure changed.
+	tol_min, tol_max, tol_leak, broken, special, active, sink = static
+	p = gas[0]+gas[1]+gas[2]
+	fb = flow.copy()
+	fb[fb <= 0.000001] = 0.0
+	
+	broke = (p*(1.0-fb) > tol_max) & ~broken & ~special
+	broken = broken | broke
+	fb[broken] = 1.0
+	fs = stress(p, fb, tol_min, tol_max, tol_leak, broken)
+	
+	# pumps talk to their neighbours through update_atmos_pres only,
+	# and unloaded tiles don't talk to anyone.
+	# the pumps' neighbours are still open to everything else.
+	fb[special] = 0.0
+	fs[special] = 0.0
+	
+	out, touched = stencil(gas, fb, fs, active, sink)
+	moved = numpy.abs(out[0]+out[1]+out[2]-p)
+	return out, touched, broke, moved
+
+def stencil(gas, fb, fs, active, sink):
+	# one Jacobi pass of Tile.update_atmos_pres over a block of rows:
+	# every active tile works out what it would push to its neighbours
+	# from the old state, then all of that gets applied in one go.
+	#
+	# a tile's result depends on what's up to two rows away,
+	# so anything working on part of the grid needs two rows of halo each side.
+	# returns the new gas arrays, and which tiles got touched.
+	p = gas[0]+gas[1]+gas[2]
+	
+	# interior + neighbour slices
+	sc = (slice(1,-1), slice(1,-1))
+	snb = [
+		(slice(0,-2), slice(1,-1)), # N
+		(slice(2,None), slice(1,-1)), # S
+		(slice(1,-1), slice(0,-2)), # W
+		(slice(1,-1), slice(2,None)), # E
+	]
+	
+	pc = p[sc]
+	fc = fs[sc]
+	pk = [p[s] for s in snb]
+	fk = [fs[s] for s in snb]
+	
+	ftotal = fk[0]+fk[1]+fk[2]+fk[3]
+	ok = active[sc] & (fc != 0.0) & (ftotal >= ATMOS_MIN_FLOW)
+	
+	# the per-tile update never bothers with tiles that wouldn't change by
+	# ATMOS_MIN_DELTA (see get_atmos_delta), so neither does this.
+	# otherwise the dregs that leak out into space get stirred around forever,
+	# and the heat riding along on them piles up.
+	delta = (abs(pk[0]-pc)*fk[0] + abs(pk[1]-pc)*fk[1] + abs(pk[2]-pc)*fk[2] + abs(pk[3]-pc)*fk[3])*fc
+	ok &= delta > ATMOS_MIN_DELTA
+	pmean = (pc + pk[0]*fk[0] + pk[1]*fk[1] + pk[2]*fk[2] + pk[3]*fk[3])/(ftotal+1.0)
+	
+	out = [g.copy() for g in gas]
+	touched = numpy.zeros(p.shape, dtype=bool)
+	touched[sc] |= ok
+	
+	for s, pn in zip(snb, pk):
+		c = (pmean-pn)*fc*ATMOS_FLOW_ADJUST/5.0
+		xd = pn+pc
+		okd = ok & (xd >= ATMOS_MIN_MIX_PRESSURE)
+		c = numpy.where(okd, c*fb[s]/numpy.where(okd, xd, 1.0), 0.0)
+		touched[s] |= ok
+		
+		for g, ng in zip(gas, out):
+			# the fraction of each gas follows the mix of both tiles
+			m = (g[sc]+g[s])*c
+			ng[s] += m
+			ng[sc] -= m
+	
+	for ng in out:
+		ng[sink] = 0.0
+		ng[touched & (ng < ATMOS_MIN_PRESSURE)] = 0.0
+	
+	return out, touched
+
+_worker_state = None
+
+def _worker_init(w, h, shm):
+	global _worker_state
+	_worker_state = (w, h, shm)
+
+def _shared_views(w, h, shm):
+	gas_sets, flow, static_in, touched, marked = shm
+	fv = lambda a: numpy.frombuffer(a, dtype=numpy.float64).reshape(h, w)
+	bv = lambda a: numpy.frombuffer(a, dtype=numpy.bool_).reshape(h, w)
+	views = {"d": fv, "b": bv}
+	
+	return ([[fv(a) for a in s] for s in gas_sets], fv(flow),
+		[views[tc](a) for tc, a in zip(STATIC_TYPES, static_in)], bv(touched), bv(marked))
+
+def _strip_step((y0, y1, gas_set)):
+	w, h, shm = _worker_state
+	gas_sets, flow, static_in, touched_out, marked = _shared_views(w, h, shm)
+	gas_in, gas_out = gas_sets[gas_set], gas_sets[1-gas_set]
+	
+	b0, b1 = max(0, y0-2), min(h, y1+2)
+	out, touched, broke, moved = grid_step([a[b0:b1] for a in gas_in], flow[b0:b1],
+		[a[b0:b1] for a in static_in])
+	
+	r0, r1 = y0-b0, y1-b0
+	for go, ng in zip(gas_out, out):
+		go[y0:y1] = ng[r0:r1]
+	touched = touched[r0:r1]
+	touched_out[y0:y1] = touched
+	new = touched & ~marked[y0:y1]
+	marked[y0:y1] |= touched
+	
+	# which tiles broke, which ones are newly dirty, and how much pressure moved, in our own rows
+	return ((numpy.flatnonzero(broke[r0:r1])+y0*w).tolist(), (numpy.flatnonzero(new)+y0*w).tolist(),
+		float(moved[r0:r1].sum()))
@@ -33,8 +33,23 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
+import bisect, ctypes, mmap
+
 from const import *
 
+# what lazy_array can hold, by array typecode
+LAZY_ARRAY_TYPES = {
+	"d": ctypes.c_double,
+	"i": ctypes.c_int,
+}
+
+def lazy_array(typecode, n):
+	# n zeroes, indexed the same as an array.array.
+	# the memory for them only gets taken a page at a time, as it's written to.
+	ct = LAZY_ARRAY_TYPES[typecode]
+	mm = mmap.mmap(-1, max(1, n)*ctypes.sizeof(ct), flags=mmap.MAP_PRIVATE)
+	return (ct*n).from_buffer(mm)
+
 def get_gradient(v, l, h):
 	iv = v
 	v = max(l, min(h, v))
@@ -52,3 +67,15 @@ def get_twogradient(v, l, m, h):
 		return get_gradient(-v, -h, -m)
 
 
+
+def get_twogradient_table(l, m, h):
+	# get_twogradient only ever steps between glyphs at fixed points,
+	# so it can be precomputed as (steps, glyphs) for get_table_glyph
+	n = float(len(VIS_GRADIENT)-1)
+	steps = [l+(k-0.5)*(m-l)/n for k in xrange(1, len(VIS_GRADIENT))]
+	steps += [h-(k-0.5)*(h-m)/n for k in xrange(len(VIS_GRADIENT)-1, 0, -1)]
+	glyphs = VIS_GRADIENT + VIS_GRADIENT[-2::-1]
+	return (steps, glyphs)
+
+def get_table_glyph(v, (steps, glyphs)):
+	return glyphs[bisect.bisect_right(steps, v)]
@@ -39,8 +39,32 @@ ATMOS_MIN_PRESSURE = 0.0001
 ATMOS_MIN_MIX_PRESSURE = 0.00001
 ATMOS_MIN_FLOW = 0.00002
 ATMOS_UPDATES_PER_TICK = 500
+ATMOS_TICK_BUDGET_MS = 15.0
 ATMOS_UPDATES_FRAME_FACTOR = 0.01
 ATMOS_FLOW_ADJUST = 0.95
+ATMOS_SETTLE_RESIDUAL = 1.0 # GameWorld.settle stops once the queued deltas add up to less than this
+ATMOS_SETTLE_MAX_TICKS = 1000
+ATMOS_SOLVE_MIN_TILES = 100 # opening a door between two zones this big skips ahead
+ATMOS_SOLVE_OPEN_TICKS = 1000 # how far ahead
+ATMOS_SOLVE_TOLERANCE = 0.000001
+ATMOS_SOLVE_MAX_ITER = 500
+ATMOS_SPACE_SINK_DIST = 3 # how far out from structures space gets simulated
+
+WORLD_CHUNK_SIZE = 32 # tiles along each side of a chunk, which is what gets loaded lazily
+# what's in a chunk of the world
+CHUNK_UNLOADED = 0 # nothing yet, it's still in the file the world came from
+CHUNK_VOID = 1 # nothing but deep space, left as the shared tile.VOID_TILES
+CHUNK_ALLOCATED = 2 # tiles of its own
+
+WORLD_CACHE_MAX_BYTES = 64<<20 # how much a worldcache.WorldCache keeps on disk
+WORLD_CACHE_MAX_ENTRIES = 16
+EDITOR_AUTOSAVE_SECS = 5.0
+EDITOR_LOAD_BUDGET_MS = 30.0 # how long the editor spends loading the world between keys
+EDITOR_TICK_RATE = 50.0 # atmos ticks per second while running
+EDITOR_MAX_CATCHUP_TICKS = 10 # any further behind than this and it just gives up on them
+EDITOR_FAST_FORWARD = [1, 2, 4, 8, None] # tick rate multipliers, None is as fast as it'll go
+EDITOR_MAX_FPS = 30.0
+EDITOR_SAVE_POLL_SECS = 0.1 # how often to check on a background save
 
 DIR_LIST_NSWE = [(0,-1),(0,1),(-1,0),(1,0)]
 
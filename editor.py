@@ -33,50 +33,88 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
-import curses, time
+import sys, select, curses, time
 
 from const import *
 import common
 import world, tile
 
 class WorldEditor:
-	def __init__(self, gs, fname, w=128, h=128):
+	def __init__(self, gs, fname, w=128, h=128, cache=None):
 		self.fname = fname
 		self.world = None
+		self.status_msg = ""
 		try:
-			self.world = world.load_new_world(fname)
+			# the rest of it gets loaded in between everything else, see step_loader
+			self.loader = world.stream_new_world(fname, self.show_load_progress, cache)
+			self.world = self.loader.next()
 		except IOError:
+			self.loader = None
 			self.world = world.GameWorld(w, h) # file didn't exist
 		
 		self.gs = gs
 		gsh, gsw = self.gs.getmaxyx()
-		self.ws = curses.newpad(h+1, w+1) # to get around a bug where (w-1,h-1) is inaccessible
-		self.ws.clear()
+		w, h = self.world.get_size()
+		self.ws = None # only as big as the view, see update_screen
 		self.curx, self.cury = w//2, h//2
 		self.camx, self.camy = (w-gsw)//2, (h-gsh)//2
 		self.picked_tile = 0
 		self.autodraw = False
 		self.running = False
-		self.repaint()
+		self.fast_forward = EDITOR_FAST_FORWARD[0]
+		self.next_tick = time.time()
+		self.autosave = False
+		self.last_save = time.time()
+		self.last_status = None
+		self.update_screen()
 	
 	def repaint(self):
+		self.ws.erase()
 		self.world.repaint_on(self.ws)
+		self.world.view_dirty = True
 	
 	def update_screen(self):
 		gsh, gsw = self.gs.getmaxyx()
 		w, h = self.world.get_size()
 		
+		# the world gets everything but the two status lines at the bottom
+		vw, vh = min(w, gsw), min(h, gsh-2)
 		if self.curx < self.camx:
 			self.camx = self.curx
 		if self.cury < self.camy:
 			self.camy = self.cury
-		if self.curx >= self.camx+gsw:
-			self.camx = self.curx-(gsw-1)
-		if self.cury >= self.camy+(gsh-1):
-			self.camy = self.cury-((gsh-1)-1)
+		if self.curx >= self.camx+vw:
+			self.camx = self.curx-(vw-1)
+		if self.cury >= self.camy+vh:
+			self.camy = self.cury-(vh-1)
+		self.camx = max(0, min(self.camx, w-vw))
+		self.camy = max(0, min(self.camy, h-vh))
+		
+		if (self.camx, self.camy, vw, vh) != self.world.view:
+			# only what's in view ever gets drawn, so moving means drawing it all again
+			if self.ws == None or self.ws.getmaxyx() != (vh+1, vw+1):
+				self.ws = curses.newpad(vh+1, vw+1) # to get around a bug where (w-1,h-1) is inaccessible
+				self.gs.erase()
+				self.last_status = None
+			self.world.set_view(self.camx, self.camy, vw, vh)
+			self.world.load_region(self.camx, self.camy, vw, vh)
+			self.repaint()
 		
 		self.world.flush_draw_queue(self.ws)
-		self.ws.overwrite(self.gs, self.camy, self.camx, 0, 0, min(h, gsh-2), min(w, gsw-1))
+		
+		t = self.world.g[self.cury][self.curx]
+		upd, ms, backlog = self.world.get_atmos_stats()
+		status = (self.status_msg, self.curx, self.cury, t.type_name, t.get_ch(), "%.5f" % t.get_pres((0,0)),
+			self.autodraw, self.picked_tile, upd, backlog, self.world.atmos_engine, self.world.atmos_budget_ms,
+			self.fast_forward)
+		if not self.world.view_dirty and status == self.last_status:
+			return # nothing on screen would change
+		self.world.view_dirty = False
+		self.last_status = status
+		
+		self.ws.overwrite(self.gs, 0, 0, 0, 0, vh-1, vw-1)
+		self.gs.addstr(gsh-2,0,self.status_msg)
+		self.gs.clrtoeol()
 		self.gs.addstr(gsh-1,0,"[%i,%i]" % (self.curx, self.cury))
 		self.gs.clrtoeol()
 		self.gs.addstr(gsh-1,10,"WldT: [ ] %s" % (self.world.g[self.cury][self.curx].type_name))
@@ -84,7 +122,9 @@ class WorldEditor:
 		self.gs.addstr(gsh-1,35,"%s: %3i [ ] %s" % ("DRAW" if self.autodraw else "PicT"
 			, self.picked_tile, tile.TILE_EXAMPLES[self.picked_tile].type_name))
 		self.gs.addstr(gsh-1,42+4,tile.TILE_EXAMPLES[self.picked_tile].get_ch())
-		self.gs.addstr(gsh-1,70,"ATM: %i" % len(self.world.atmos_queue))
+		self.gs.addstr(gsh-1,70,"ATM: %i/%i %s%s%s" % (upd, backlog, self.world.atmos_engine
+			, "" if self.world.atmos_budget_ms == None else " %ims" % self.world.atmos_budget_ms
+			, "" if self.fast_forward == 1 else " x%s" % (self.fast_forward or "max")))
 		#q = self.world.g[self.cury][self.curx].get_atmos_delta(
 		#	self.world.g[self.cury-1][self.curx],
 		#	self.world.g[self.cury+1][self.curx],
@@ -97,9 +137,8 @@ class WorldEditor:
 		self.gs.refresh()
 	
 	def put_tile(self, x, y, tile):
-		self.world.g[y][x] = tile
+		self.world.put_tile(x, y, tile)
 		self.world.draw_tile(self.ws, x, y)
-		self.world.enqueue_atmos_update(x,y)
 	
 	def put_tile_cur(self):
 		self.put_tile(self.curx, self.cury, tile.TILE_TYPES[self.picked_tile](self.world, self.curx, self.cury))
@@ -108,63 +147,164 @@ class WorldEditor:
 		if self.autodraw:
 			self.put_tile_cur()
 	
+	def show_load_progress(self, nbytes, total_bytes, ntiles, total_tiles):
+		self.status_msg = "Loading... %i%% (%i/%i KB)" % (ntiles*100//total_tiles, nbytes//1024, total_bytes//1024)
+	
+	def step_loader(self):
+		# loads chunks for a little while, then gets back to everything else
+		if self.loader == None:
+			return
+		
+		deadline = time.time() + EDITOR_LOAD_BUDGET_MS/1000.0
+		try:
+			while time.time() < deadline:
+				self.loader.next()
+		except StopIteration:
+			self.loader = None
+			self.status_msg = "Loaded."
+	
+	def save_background(self):
+		if self.world.save_world_background(self.fname):
+			self.last_save = time.time()
+			self.status_msg = "Saving..."
+	
+	def handle_key(self, k):
+		gsh, gsw = self.gs.getmaxyx()
+		w, h = self.world.get_size()
+		
+		if k == "\x1B":
+			k = self.gs.getkey()
+			if k == "[":
+				k = self.gs.getkey()
+				if k == "A":
+					self.cury = max(1, self.cury-1)
+					self.check_autodraw()
+				elif k == "B":
+					self.cury = min(h-2, self.cury+1)
+					self.check_autodraw()
+				elif k == "C":
+					self.curx = min(w-2, self.curx+1)
+					self.check_autodraw()
+				elif k == "D":
+					self.curx = max(1, self.curx-1)
+					self.check_autodraw()
+		elif k == "[":
+			self.picked_tile = max(0, self.picked_tile-1)
+		elif k == "]":
+			self.picked_tile = min(len(tile.TILE_TYPES)-1, self.picked_tile+1)
+		elif k == " ":
+			self.put_tile_cur()
+		elif k == "\n":
+			t = self.world.get_tile(self.curx, self.cury)
+			tc = t.save_type or t.tile_type
+			if tc in tile.TILE_TYPES:
+				self.picked_tile = tile.TILE_TYPES.index(tc)
+		elif k == "\t":
+			self.autodraw = not self.autodraw
+			if self.autodraw:
+				self.put_tile_cur()
+		elif k == "T":
+			self.world.tick_full(self.ws)
+		elif k == "W":
+			self.world.settle(self.ws)
+		elif k == "r":
+			self.running = not self.running
+			self.next_tick = time.time()
+		elif k == "t":
+			self.world.tick(self.ws)
+		elif k == "b":
+			self.world.atmos_budget_ms = ATMOS_TICK_BUDGET_MS if self.world.atmos_budget_ms == None else None
+		elif k == "g":
+			try:
+				self.world.set_atmos_engine({"tile": "grid", "grid": "parallel", "parallel": "tile"}[self.world.atmos_engine])
+			except self.world.AtmosEngineException:
+				pass
+		elif k == "p":
+			self.world.pressure_view = not self.world.pressure_view
+			self.repaint()
+		elif k == "P":
+			self.world.get_tile(self.curx, self.cury).add_pres(air=1.0)
+		elif k == "e":
+			self.world.get_tile(self.curx, self.cury).on_touch()
+		elif k == "S":
+			self.world.save_journal(self.fname)
+		elif k == "C":
+			self.save_background()
+		elif k == "a":
+			self.autosave = not self.autosave
+		elif k == "f":
+			i = EDITOR_FAST_FORWARD.index(self.fast_forward)
+			self.fast_forward = EDITOR_FAST_FORWARD[(i+1) % len(EDITOR_FAST_FORWARD)]
+	
+	def step_sim(self, deadline):
+		# runs whatever ticks are due at the fixed tick rate, catching up on
+		# any that got missed, but giving up by the deadline so keys still get in
+		if not self.running:
+			return False
+		
+		now = time.time()
+		n = 0
+		if self.fast_forward == None:
+			while n == 0 or time.time() < deadline:
+				self.world.tick(self.ws)
+				n += 1
+			self.next_tick = time.time()
+		else:
+			step = 1.0/(EDITOR_TICK_RATE*self.fast_forward)
+			if now-self.next_tick > EDITOR_MAX_CATCHUP_TICKS*step:
+				self.next_tick = now
+			while self.next_tick <= now and (n == 0 or time.time() < deadline):
+				self.world.tick(self.ws)
+				self.next_tick += step
+				n += 1
+		
+		if n > 0 and self.autosave and time.time() >= self.last_save+EDITOR_AUTOSAVE_SECS:
+			self.save_background()
+		return n > 0
+	
 	def run(self):
+		next_frame = time.time()
+		dirty = True
 		while True:
-			gsh, gsw = self.gs.getmaxyx()
-			w, h = self.world.get_size()
+			# sleep until there's a key or something else wants doing
+			now = time.time()
+			due = []
+			if self.loader != None:
+				due.append(now)
+			if self.running:
+				due.append(self.next_tick)
+			if dirty:
+				due.append(next_frame)
+			if self.world.save_job != None:
+				due.append(now+EDITOR_SAVE_POLL_SECS)
+			try:
+				select.select([sys.stdin], [], [], max(0.0, min(due)-now) if due else None)
+			except select.error:
+				pass # interrupted, most likely by the terminal getting resized
 			
-			k = self.gs.getch()
-			k = "" if k == -1 else chr(k)
+			while True:
+				k = self.gs.getch()
+				if k == -1:
+					break
+				if k < 256:
+					self.handle_key(chr(k))
+				dirty = True
 			
-			if k == "\x1B":
-				k = self.gs.getkey()
-				if k == "[":
-					k = self.gs.getkey()
-					if k == "A":
-						self.cury = max(1, self.cury-1)
-						self.check_autodraw()
-					elif k == "B":
-						self.cury = min(h-2, self.cury+1)
-						self.check_autodraw()
-					elif k == "C":
-						self.curx = min(w-2, self.curx+1)
-						self.check_autodraw()
-					elif k == "D":
-						self.curx = max(1, self.curx-1)
-						self.check_autodraw()
-			elif k == "[":
-				self.picked_tile = max(0, self.picked_tile-1)
-			elif k == "]":
-				self.picked_tile = min(len(tile.TILE_TYPES)-1, self.picked_tile+1)
-			elif k == " ":
-				self.put_tile_cur()
-			elif k == "\n":
-				npt = tile.TILE_TYPES.index(self.world.g[self.cury][self.curx].__class__)
-				if npt != -1:
-					self.picked_tile = npt
-			elif k == "\t":
-				self.autodraw = not self.autodraw
-				if self.autodraw:
-					self.put_tile_cur()
-			elif k == "T":
-				self.world.tick_full(self.ws)
-			elif k == "r":
-				self.running = not self.running
-			elif k == "t":
-				self.world.tick(self.ws)
-			elif k == "p":
-				self.world.pressure_view = not self.world.pressure_view
-				self.repaint()
-			elif k == "P":
-				self.world.g[self.cury][self.curx].add_pres(air=1.0)
-			elif k == "e":
-				self.world.g[self.cury][self.curx].on_touch()
-			elif k == "S":
-				self.world.save_world(self.fname)
+			if self.step_sim(max(next_frame, time.time()+1.0/EDITOR_MAX_FPS)):
+				dirty = True
 			
-			if self.running:
-				self.world.tick(self.ws)
+			r = self.world.poll_save()
+			if r != None:
+				ok, why = r
+				self.status_msg = "Saved." if ok else "Save failed: %s" % why
+				dirty = True
 			
-			self.update_screen()
-			time.sleep(0.02)
-
+			if self.loader != None:
+				self.step_loader()
+				dirty = True
+			
+			now = time.time()
+			if dirty and now >= next_frame:
+				self.update_screen()
+				dirty = False
+				next_frame = now+1.0/EDITOR_MAX_FPS
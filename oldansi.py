@@ -25,6 +25,9 @@ def flip_fix_xy(f):
 	
 	return _f1
 
+BLANK = (' ',0x07)
+RUN_GAP = 6 # unchanged cells in a row that are cheaper to resend than to jump over
+
 class GameScreen:
 	def __init__(self, w=80, h=23):
 		self.resize(w,h)
@@ -33,26 +36,36 @@ class GameScreen:
 	
 	def resize(self, w, h):
 		self.w, self.h = w, h
-		self.g = [[[' ',0x07] for x in xrange(self.w)] for y in xrange(self.h)]
+		self.g = [[BLANK]*self.w for y in xrange(self.h)]
+		
+		# what's actually on the terminal, None if it needs clearing first
+		self.front = None
+		# both of those are rings of rows starting from here, see scroll
+		self.top = 0
+		# whatever needs sending before the next lot of changes
+		self.out = []
+		# where the terminal's cursor is and what colour it's on, None if unknown
+		self.tpos = None
+		self.tcol = None
 	
 	def set_cursor(self, x, y):
 		self.cx = max(0,min(self.w-1,x))
 		self.cy = max(0,min(self.h-1,y))
 	
-	def __set_pos(self, x, y):
-		x = max(0,min(self.w-1,x))
-		y = max(0,min(self.h-1,y))
-		sys.stdout.write("\x1B[%i;%iH" % (y+1,x+1))
+	def get_cursor(self):
+		return self.cx, self.cy
+	
+	def __get_pos_seq(self, x, y):
+		return "\x1B[%i;%iH" % (y+1,x+1)
 	
 	def set_pos(self, x, y):
 		self.dx = max(0,min(self.w-1,x))
 		self.dy = max(0,min(self.h-1,y))
-		self.__set_pos(self.dx, self.dy)
 	
 	def get_pos(self):
 		return self.dx, self.dy
 	
-	def __set_color(self, col):
+	def __get_color_seq(self, col):
 		fg = col & 0x7
 		bg = (col >> 4) & 0x7
 		blink = col & 0x80
@@ -68,21 +81,21 @@ class GameScreen:
 		if bg != 0:
 			s += ";4%i" % COLMAP[bg]
 		
-		sys.stdout.write(s+"m")
+		return s+"m"
 	
 	def set_color(self, col):
-		self.__set_color(col)
 		self.ccol = col
 	
 	def __write(self, s):
-		sys.stdout.write(s)
-		for c in s:
-			self.g[self.dy][self.dx] = [c,self.ccol]
+		# only goes into the back buffer, flush is what sends it
+		l = self.g[(self.top+self.dy) % self.h]
+		for c in s[:self.w-self.dx]:
+			l[self.dx] = (c,self.ccol)
 			self.dx += 1
 	
 	def write(self, s):
 		while self.dx+len(s) >= self.w:
-			d = w-self.dx+len(s)
+			d = self.w-self.dx
 			cs, s = s[:d], s[d:]
 			self.__write(cs)
 			self.set_pos(0, self.dy+1)
@@ -114,6 +127,29 @@ class GameScreen:
 				self.set_pos(x,y)
 				self.write(ch)
 	
+	def __scroll_rows(self, y):
+		# moves every row up by y (down if negative), blanking what's exposed
+		self.top = (self.top+y) % self.h
+		exposed = xrange(self.h-y, self.h) if y > 0 else xrange(0, -y)
+		for i in exposed:
+			self.g[(self.top+i) % self.h] = [BLANK]*self.w
+			if self.front != None:
+				self.front[(self.top+i) % self.h] = [BLANK]*self.w
+	
+	def __get_scroll_seq(self, y):
+		# scrolls just our rows of the terminal, using a scroll region
+		# and index (ESC D) at the bottom or reverse index (ESC M) at the top.
+		# the 0m is so the exposed lines come out blank and not in some colour
+		s = "\x1B[0m\x1B[1;%ir" % self.h
+		if y > 0:
+			s += self.__get_pos_seq(0,self.h-1) + "\x1BD"*y
+		else:
+			s += self.__get_pos_seq(0,0) + "\x1BM"*-y
+		
+		self.tcol = 0x07
+		self.tpos = None # setting the scroll region homes the cursor
+		return s + "\x1B[r"
+	
 	def scroll(self, x, y):
 		odx, ody = self.get_pos()
 		ocx, ocy = self.get_cursor()
@@ -123,46 +159,85 @@ class GameScreen:
 		if clearme:
 			self.resize(self.w, self.h)
 		else:
-			if y > 0:
-				self.g = self.g[y:] + [[[' ',0x07] for j in xrange(self.w)] for i in xrange(y)]
-			elif y < 0:
-				self.g = [[[' ',0x07] for j in xrange(self.w)] for i in xrange(-y)] + self.g[:self.h+y]
+			if y != 0:
+				# the terminal does the moving, so only the exposed rows get sent
+				if self.front != None:
+					self.out.append(self.__get_scroll_seq(y))
+				self.__scroll_rows(y)
 			
-			if x != 0:
+			# terminals can't be relied on to scroll sideways, so that's left to flush
+			if x > 0:
+				for l in self.g:
+					l[:] = l[x:] + [BLANK]*x
+			elif x < 0:
 				for l in self.g:
-					if x > 0:
-						l = l[x:] + [[' ',0x07] for j in xrange(x)]
-					elif x < 0:
-						l = [[' ',0x07] for j in xrange(-x)] + l[:self.w+x]
+					l[:] = [BLANK]*-x + l[:self.w+x]
 		
 		self.set_cursor(ocx-x, ocy-y)
 		self.set_pos(odx-x, ody-y)
-		self.repaint()
-	
-	def __clear_screen(self):
-		sys.stdout.write("\x1B[0m\x1B[2J")
+		self.flush()
 	
 	def clear_screen(self):
-		self.__clear_screen()
-		self.resize(self.w, self.h)
+		self.g = [[BLANK]*self.w for y in xrange(self.h)]
+		self.front = None # cheaper to clear it outright than to send all the spaces
+	
+	def __get_run_seq(self, y, x1, x2):
+		out = []
+		if self.tpos != (x1,y):
+			out.append(self.__get_pos_seq(x1,y))
+		
+		for ch, col in self.g[(self.top+y) % self.h][x1:x2]:
+			if col != self.tcol:
+				out.append(self.__get_color_seq(col))
+				self.tcol = col
+			
+			out.append(ch)
+		
+		# terminals differ on where the cursor goes after the last column
+		self.tpos = (x2,y) if x2 < self.w else None
+		return "".join(out)
 	
 	def flush(self):
-		self.__set_pos(self.cx, self.cy)
+		# sends only what differs between the back buffer and the terminal,
+		# all in the one write
+		out, self.out = self.out, []
+		if self.front == None:
+			out.append("\x1B[0m\x1B[2J")
+			self.front = [[BLANK]*self.w for y in xrange(self.h)]
+			self.tpos = None
+			self.tcol = 0x07
+		
+		for y in xrange(self.h):
+			i = (self.top+y) % self.h
+			bl, fl = self.g[i], self.front[i]
+			if bl == fl:
+				continue
+			
+			x1 = x2 = None
+			for x in xrange(self.w):
+				if bl[x] == fl[x]:
+					continue
+				
+				if x1 != None and x-x2 > RUN_GAP:
+					out.append(self.__get_run_seq(y, x1, x2))
+					x1 = None
+				if x1 == None:
+					x1 = x
+				x2 = x+1
+			
+			out.append(self.__get_run_seq(y, x1, x2))
+			self.front[i] = list(bl)
+		
+		if self.tpos != (self.cx,self.cy):
+			out.append(self.__get_pos_seq(self.cx,self.cy))
+			self.tpos = (self.cx,self.cy)
+		
+		sys.stdout.write("".join(out))
 		sys.stdout.flush()
 	
 	def repaint(self):
-		cdef = -1
-		self.__clear_screen()
-		self.__set_pos(0,0)
-		for y,l in zip(xrange(self.h),self.g):
-			self.__set_pos(0,y)
-			for ch, col in l:
-				if col != cdef:
-					self.__set_color(col)
-					cdef = col
-				
-				sys.stdout.write(ch)
-		
+		# forget what's on the terminal so the lot gets sent again
+		self.front = None
 		self.flush()
 
 gs = GameScreen(79,23)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+class IndexedHeap:
+	# binary min-heap which knows where each key lives,
+	# so a queued key can have its priority changed in place
+	def __init__(self):
+		self.clear()
+	
+	def clear(self):
+		self.heap = [] # [prio, key] pairs
+		self.pos = {} # key -> index into heap
+	
+	def __len__(self):
+		return len(self.heap)
+	
+	def __contains__(self, key):
+		return key in self.pos
+	
+	def push(self, key, prio):
+		# adds key, or moves it if it's already queued
+		i = self.pos.get(key)
+		if i == None:
+			i = len(self.heap)
+			self.heap.append([prio, key])
+			self.pos[key] = i
+			self.sift_up(i)
+		elif prio < self.heap[i][0]:
+			self.heap[i][0] = prio
+			self.sift_up(i)
+		elif prio > self.heap[i][0]:
+			self.heap[i][0] = prio
+			self.sift_down(i)
+	
+	def decrease(self, key, prio):
+		# adds key, or moves it closer to the top if prio is better
+		i = self.pos.get(key)
+		if i == None or prio < self.heap[i][0]:
+			self.push(key, prio)
+	
+	def pop(self):
+		heap = self.heap
+		prio, key = heap[0]
+		del self.pos[key]
+		
+		last = heap.pop()
+		if heap:
+			heap[0] = last
+			self.pos[last[1]] = 0
+			self.sift_down(0)
+		
+		return prio, key
+	
+	def pop_many(self, n):
+		return [self.pop() for i in xrange(min(n, len(self.heap)))]
+	
+	def remove(self, key):
+		i = self.pos.pop(key)
+		heap = self.heap
+		last = heap.pop()
+		if i < len(heap):
+			heap[i] = last
+			self.pos[last[1]] = i
+			self.sift_up(i)
+			self.sift_down(self.pos[last[1]])
+	
+	def sift_up(self, i):
+		heap, pos = self.heap, self.pos
+		e = heap[i]
+		while i > 0:
+			pi = (i-1)>>1
+			pe = heap[pi]
+			if e[0] >= pe[0]:
+				break
+			heap[i] = pe
+			pos[pe[1]] = i
+			i = pi
+		
+		heap[i] = e
+		pos[e[1]] = i
+	
+	def sift_down(self, i):
+		heap, pos = self.heap, self.pos
+		n = len(heap)
+		e = heap[i]
+		while True:
+			ci = 2*i+1
+			if ci >= n:
+				break
+			if ci+1 < n and heap[ci+1][0] < heap[ci][0]:
+				ci += 1
+			ce = heap[ci]
+			if ce[0] >= e[0]:
+				break
+			heap[i] = ce
+			pos[ce[1]] = i
+			i = ci
+		
+		heap[i] = e
+		pos[e[1]] = i
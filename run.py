@@ -33,22 +33,27 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
-import sys, struct, time
+import os, sys, struct, time
 import math, heapq
 import curses
 
 from const import *
 import common
-import editor
+import editor, worldcache
 
 working_fname = sys.argv[1]
 
+# opt-in, for when the same worlds get loaded over and over
+cache = None
+if os.environ.get("SS314_WORLD_CACHE"):
+	cache = worldcache.WorldCache(os.environ["SS314_WORLD_CACHE"])
+
 try:
 	gs = curses.initscr()
 	gs.clear()
 	gs.nodelay(1)
 	curses.noecho()
-	we = editor.WorldEditor(gs,working_fname,128,128)
+	we = editor.WorldEditor(gs,working_fname,128,128,cache)
 	we.run()
 finally:
 	curses.endwin()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import sys, time
+
+import world, tile, atmosgrid
+from tests import maps
+
+# times the grid engines on one big station, with all of it simulated.
+# run with python2 -m tests.bench_atmosgrid [size [procs...]]
+
+def build(n):
+	# a station filling the whole map, split up by walls with gaps in them,
+	# gas scattered all over the place and a pump to keep the per-tile part honest
+	wd = world.GameWorld(n, n)
+	for y in xrange(2, n-2):
+		for x in xrange(2, n-2):
+			edge = y in (2, n-3) or x in (2, n-3) or (x % 64 == 0 and y % 5)
+			maps.put(wd, x, y, tile.WallTile if edge else tile.FloorTile)
+	for k in xrange(n*4):
+		x, y = 3+(k*7919)%(n-6), 3+(k*104729)%(n-6)
+		wd.g[y][x].change_pres(air=float(k%20))
+	maps.put(wd, 100 % (n-6) + 3, 100 % (n-6) + 3, tile.PumpTile)
+	return wd
+
+def run(wd, ticks):
+	ws = maps.NullScreen()
+	wd.tick(ws) # builds the static arrays
+	t0 = time.time()
+	for k in xrange(ticks):
+		wd.tick(ws)
+	return (time.time()-t0)/ticks*1000.0
+
+def main(args):
+	n = int(args[0]) if args else 512
+	procs = [int(p) for p in args[1:]] or [1, 2, 4]
+	ticks = 10
+	
+	wd = build(n)
+	wd.set_atmos_engine("grid")
+	ms = run(wd, ticks)
+	air = wd.pres_lvl_air[:]
+	print "%ix%i, %i cpus" % (n, n, atmosgrid.multiprocessing.cpu_count())
+	print "grid: %.1f ms/tick" % ms
+	
+	for p in procs:
+		wd = build(n)
+		wd.set_atmos_engine("grid")
+		wd.grid_engine = atmosgrid.ParallelGridEngine(wd, p)
+		ms = run(wd, ticks)
+		same = wd.pres_lvl_air[:] == air
+		wd.grid_engine.close()
+		print "parallel, %i procs: %.1f ms/tick%s" % (p, ms, "" if same else " (differs from grid!)")
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+# maps the tests share
+
+import world, tile
+
+class NullScreen:
+	# stands in for the curses window the world draws on
+	def getmaxyx(self):
+		return 1<<15, 1<<15
+	
+	def addstr(self, y, x, s):
+		pass
+
+def put(wd, x, y, tc):
+	t = tc(wd, x, y)
+	wd.put_tile(x, y, t)
+	return t
+
+def build_rooms(w=40, h=30):
+	# two rooms either side of a wall with a door and a valve in it,
+	# a tank and a pump on either side, and a breach out to space.
+	# returns the world and the door, valve and pump.
+	wd = world.GameWorld(w, h)
+	for y in xrange(5, 20):
+		for x in xrange(5, 30):
+			put(wd, x, y, tile.WallTile if y in (5, 19) or x in (5, 29) else tile.FloorTile)
+	for y in xrange(6, 19):
+		put(wd, 17, y, tile.WallTile)
+	
+	door = put(wd, 17, 10, tile.DoorTile)
+	valve = put(wd, 17, 14, tile.ValveTile)
+	put(wd, 10, 10, tile.TankTile)
+	pump = put(wd, 22, 12, tile.PumpTile)
+	put(wd, 29, 12, tile.FloorTile)
+	
+	wd.g[8][8].add_pres(air=20.0)
+	wd.g[12][20].add_pres(plasma=3.0)
+	return wd, door, valve, pump
+
+def total_gas(wd):
+	return sum(sum(getattr(wd, k)) for k in ("pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins"))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import unittest
+
+import atmosgrid
+import tile
+import world
+from tests import maps
+
+@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+class GridParityTest(unittest.TestCase):
+	# the grid engine goes through the tiles in a different order,
+	# so it only has to stay close to the per-tile update, not match it exactly
+	def build(self, engine, breach):
+		wd, door, valve, pump = maps.build_rooms()
+		if not breach:
+			maps.put(wd, 29, 12, tile.WallTile)
+		door.on_touch()
+		wd.set_atmos_engine(engine)
+		return wd, pump
+	
+	def run_both(self, breach, ticks=300):
+		ws = maps.NullScreen()
+		a, pa = self.build("tile", breach)
+		b, pb = self.build("grid", breach)
+		for n in xrange(ticks):
+			a.tick_full(ws)
+			b.tick_full(ws)
+		return a, pa, b, pb
+	
+	def assertClose(self, a, b, delta):
+		for k in ("pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins"):
+			u, v = getattr(a, k), getattr(b, k)
+			err = max(abs(p-q) for p, q in zip(u, v))
+			self.assertLess(err, delta, "%s differs by %f" % (k, err))
+		
+		# heat only moves along with the gas, so it stays wherever the order
+		# of updates happened to leave it. only the total is comparable.
+		ha, hb = sum(a.heat_lvl), sum(b.heat_lvl)
+		self.assertAlmostEqual(ha, hb, delta=0.05*ha)
+	
+	def test_sealed_with_pump(self):
+		a, pa, b, pb = self.run_both(False)
+		self.assertClose(a, b, 0.05)
+		self.assertAlmostEqual(pa.get_pres(), pb.get_pres(), delta=0.05)
+		self.assertAlmostEqual(maps.total_gas(a), maps.total_gas(b), delta=0.01)
+		
+		# the pump has actually pumped something
+		self.assertGreater(pb.get_pres(), 1.5)
+	
+	def test_breach_with_pump(self):
+		a, pa, b, pb = self.run_both(True)
+		self.assertClose(a, b, 0.1)
+		self.assertAlmostEqual(pa.get_pres(), pb.get_pres(), delta=0.1)
+		self.assertAlmostEqual(maps.total_gas(a), maps.total_gas(b), delta=0.01*maps.total_gas(a))
+
+	def test_switch_back_to_tile(self):
+		ws = maps.NullScreen()
+		wd, pump = self.build("grid", False)
+		for n in xrange(5):
+			wd.tick(ws)
+		
+		wd.set_atmos_engine("tile")
+		self.assertTrue(wd.atmos_queue)
+		air = wd.pres_lvl_air[:]
+		wd.tick(ws)
+		self.assertNotEqual(air, wd.pres_lvl_air[:])
+
+@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+class GridStaticTest(unittest.TestCase):
+	def test_changed_tiles_match_full_rebuild(self):
+		ws = maps.NullScreen()
+		wd, door, valve, pump = maps.build_rooms()
+		wd.set_atmos_engine("grid")
+		wd.tick(ws)
+		
+		# a new pump, a pump gone, and a door opened
+		maps.put(wd, 25, 8, tile.PumpTile)
+		maps.put(wd, 22, 12, tile.FloorTile)
+		door.on_touch()
+		ge = wd.grid_engine
+		self.assertTrue(ge.dirty)
+		ge.update_static()
+		got = ge.static
+		
+		ge.build_static()
+		for a, b in zip(got[:-1], ge.static[:-1]):
+			self.assertTrue((a == b).all())
+		self.assertEqual(sorted(got[-1]), sorted(ge.static[-1]))
+
+@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+class ParallelTest(unittest.TestCase):
+	def run_engine(self, engine):
+		ws = maps.NullScreen()
+		wd, door, valve, pump = maps.build_rooms()
+		valve.add_pres(air=10.0) # enough to blow it out
+		wd.set_atmos_engine("grid")
+		if engine != None:
+			wd.grid_engine = engine(wd)
+		
+		for n in xrange(60):
+			if n == 10:
+				door.on_touch()
+			if n == 20:
+				pump.on_touch()
+			wd.tick(ws)
+		
+		if engine != None:
+			wd.grid_engine.close()
+		return wd
+	
+	def test_same_as_grid(self):
+		a = self.run_engine(None)
+		for procs in (1, 3):
+			b = self.run_engine(lambda wd: atmosgrid.ParallelGridEngine(wd, procs))
+			for k in atmosgrid.GAS_FIELDS:
+				self.assertEqual(getattr(a, k)[:], getattr(b, k)[:])
+			self.assertAlmostEqual(a.get_atmos_residual(), b.get_atmos_residual(), delta=1e-9)
+			
+			broken = lambda wd: [(x, y) for y in xrange(wd.h) for x in xrange(wd.w) if wd.g[y][x].broken]
+			self.assertTrue(broken(a))
+			self.assertEqual(broken(a), broken(b))
+
+@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+class ZoneSolveTest(unittest.TestCase):
+	def build(self, split=34):
+		# a long hall with a wall at x=split, and a door in it.
+		# the left side has twice the air in it.
+		wd = world.GameWorld(70, 30)
+		for y in xrange(2, 26):
+			for x in xrange(2, 66):
+				maps.put(wd, x, y, tile.WallTile if y in (2, 25) or x in (2, 65, split) else tile.FloorTile)
+		door = maps.put(wd, split, 13, tile.DoorTile)
+		for y in xrange(3, 25):
+			for x in xrange(3, split):
+				wd.g[y][x].change_pres(air=1.0, toxins=0.5)
+		wd.tick_full(maps.NullScreen())
+		return wd, door
+	
+	def totals(self, wd):
+		return [sum(getattr(wd, k)) for k in atmosgrid.GAS_FIELDS]
+	
+	def test_opening_between_big_zones_skips_ahead(self):
+		wd, door = self.build()
+		before = self.totals(wd)
+		door.on_touch()
+		
+		for u, v in zip(before, self.totals(wd)):
+			self.assertAlmostEqual(u, v, delta=1e-6*u)
+		
+		# it's only skipped ahead, it hasn't evened out yet
+		far_left, near, far_right = (wd.g[13][x].get_pres() for x in (3, 35, 64))
+		self.assertGreater(near, 1.2)
+		self.assertGreater(far_left, far_right+0.5)
+	
+	def test_opening_onto_small_zone_does_nothing(self):
+		wd, door = self.build(split=6)
+		air = wd.pres_lvl_air[:]
+		door.on_touch()
+		self.assertEqual(air, wd.pres_lvl_air[:])
+	
+	def test_zone_open_to_space(self):
+		wd, door = self.build()
+		maps.put(wd, 65, 13, tile.FloorTile)
+		wd.tick_full(maps.NullScreen())
+		before = self.totals(wd)
+		door.on_touch()
+		
+		# what got through the door has started leaking out
+		after = self.totals(wd)
+		self.assertLess(after[0], before[0]-1.0)
+		self.assertLess(after[2], before[2])
+
+if __name__ == "__main__":
+	unittest.main()
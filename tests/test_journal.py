@@ -0,0 +1,117 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import os, shutil, tempfile, unittest
+
+import world, atmosgrid
+from tests import maps
+
+class JournalTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.fname = os.path.join(self.path, "rooms.wld")
+	
+	def tearDown(self):
+		shutil.rmtree(self.path)
+	
+	def assertSameAtmos(self, a, b):
+		# files store float32
+		for k in ("pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins", "heat_lvl"):
+			for i, (u, v) in enumerate(zip(getattr(a, k), getattr(b, k))):
+				self.assertAlmostEqual(u, v, delta=1e-4*max(1.0, abs(u)),
+					msg="%s differs at %i,%i: %r %r" % (k, i%a.w, i//a.w, u, v))
+	
+	def tick_and_reload(self, engine):
+		wd, door, valve, pump = maps.build_rooms()
+		ws = maps.NullScreen()
+		wd.set_atmos_engine(engine)
+		wd.save_world(self.fname)
+		
+		wd.tick_full(ws)
+		
+		# the second journal has to pick up tiles that were in the first one too
+		for toggle in (door, pump):
+			for n in xrange(50):
+				if n == 10:
+					toggle.on_touch()
+				wd.tick(ws)
+			self.assertTrue(wd.dirty_tiles)
+			wd.save_journal(self.fname)
+			
+			wd2 = world.load_new_world(self.fname)
+			self.assertSameAtmos(wd, wd2)
+			self.assertAlmostEqual(maps.total_gas(wd), maps.total_gas(wd2), delta=1e-3)
+		
+		return wd
+	
+	def test_ticked_gas_survives_journal(self):
+		self.tick_and_reload("tile")
+	
+	@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+	def test_grid_ticked_gas_survives_journal(self):
+		self.tick_and_reload("grid")
+	
+	@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+	def test_parallel_ticked_gas_survives_journal(self):
+		wd = self.tick_and_reload("parallel")
+		wd.set_atmos_engine("tile")
+	
+	@unittest.skipUnless(atmosgrid.available(), "needs numpy")
+	def test_parallel_background_save_is_a_snapshot(self):
+		wd, door, valve, pump = maps.build_rooms()
+		ws = maps.NullScreen()
+		wd.set_atmos_engine("parallel")
+		door.on_touch()
+		for n in xrange(5):
+			wd.tick(ws)
+		
+		# the workers keep going while the save is still writing out the gas
+		snap = world.GameWorld(wd.w, wd.h)
+		for k in ("pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins", "heat_lvl"):
+			setattr(snap, k, getattr(wd, k)[:])
+		self.assertTrue(wd.save_world_background(self.fname))
+		for n in xrange(20):
+			wd.tick(ws)
+		wd.wait_save()
+		self.assertEqual(wd.poll_save(), (True, None))
+		self.assertSameAtmos(snap, world.load_new_world(self.fname))
+		
+		air = wd.pres_lvl_air[:]
+		wd.set_atmos_engine("tile")
+		self.assertEqual(air, wd.pres_lvl_air[:])
+
+if __name__ == "__main__":
+	unittest.main()
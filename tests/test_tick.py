@@ -0,0 +1,107 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import unittest
+
+import tile
+from tests import maps
+
+class TickTest(unittest.TestCase):
+	def count_updates(self, wd, budget_ms):
+		counts = {}
+		update = wd.update_atmos_at
+		def counted(x, y):
+			counts[(x,y)] = counts.get((x,y), 0)+1
+			update(x, y)
+		wd.update_atmos_at = counted
+		wd.tick(maps.NullScreen(), budget_ms)
+		return counts
+	
+	def test_budgeted_tick_updates_each_tile_once(self):
+		wd, door, valve, pump = maps.build_rooms()
+		wd.tick_full(maps.NullScreen())
+		door.on_touch()
+		
+		# long enough to get through everything that's queued
+		counts = self.count_updates(wd, 1000.0)
+		self.assertTrue(counts)
+		self.assertEqual(max(counts.values()), 1)
+		
+		# what got updated is queued again for the next tick
+		self.assertTrue(wd.atmos_queue)
+		self.assertEqual(len(wd.atmos_queue), len(wd.atmos_delta))
+	
+	def test_disturbed_tile_moves_up_the_queue(self):
+		wd, door, valve, pump = maps.build_rooms()
+		wd.tick_full(maps.NullScreen())
+		
+		# the least urgent thing queued suddenly gets a lot more gas
+		prio, (x, y) = max(wd.atmos_queue.heap)
+		wd.g[y][x].add_pres(air=50.0)
+		
+		self.assertEqual(wd.atmos_queue.pop()[1], (x, y))
+		self.assertAlmostEqual(wd.atmos_residual, sum(wd.atmos_delta.values()), delta=1e-6)
+	
+	def test_replaced_tile_leaves_the_queue(self):
+		wd, door, valve, pump = maps.build_rooms()
+		wd.tick_full(maps.NullScreen())
+		
+		prio, (x, y) = max(wd.atmos_queue.heap)
+		wd.put_tile(x, y, tile.WallTile(wd, x, y))
+		self.assertFalse((x, y) in wd.atmos_queue)
+		self.assertEqual(len(wd.atmos_queue), len(wd.atmos_delta))
+	
+	def test_plain_tiles_update_the_same_as_the_rest(self):
+		ws = maps.NullScreen()
+		worlds = []
+		for plain in (True, False):
+			wd, door, valve, pump = maps.build_rooms()
+			if not plain:
+				for tc in wd.tile_types.values():
+					tc.atmos_plain = False
+			door.on_touch()
+			wd.tick_full(ws)
+			for n in xrange(20):
+				wd.tick(ws)
+			worlds.append(wd)
+		
+		a, b = worlds
+		for k in tile.ATMOS_FIELDS:
+			self.assertEqual(getattr(a, k)[:], getattr(b, k)[:], msg=k)
+		self.assertEqual(sorted(a.atmos_delta.items()), sorted(b.atmos_delta.items()))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import os, shutil, tempfile, unittest
+
+import world, worldcache, worldfile, tile
+from tests import maps
+
+class WorldCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.fname = os.path.join(self.path, "rooms.wld")
+		self.cache = worldcache.WorldCache(os.path.join(self.path, "cache"))
+	
+	def tearDown(self):
+		shutil.rmtree(self.path)
+	
+	def test_cached_v3_stays_compressed(self):
+		wd, door, valve, pump = maps.build_rooms()
+		wd.tick_full(maps.NullScreen())
+		wd.save_world(self.fname)
+		
+		world.load_new_world(self.fname, cache=self.cache)
+		ename = self.cache.get_entry_name(self.fname) + ".wld"
+		self.assertTrue(os.path.exists(ename))
+		self.assertLessEqual(os.path.getsize(ename), os.path.getsize(self.fname))
+		
+		wd2 = world.load_new_world(self.fname, cache=self.cache)
+		self.assertEqual(wd2.source.fname, ename)
+		self.assertAlmostEqual(maps.total_gas(wd), maps.total_gas(wd2), delta=1e-3)
+		for y in xrange(wd.h):
+			self.assertEqual([t.tile_type for t in wd.g[y]], [t.tile_type for t in wd2.g[y]])
+	
+	def test_cached_world_saves_journal(self):
+		wd, door, valve, pump = maps.build_rooms()
+		wd.save_world(self.fname)
+		size = os.path.getsize(self.fname)
+		
+		world.load_new_world(self.fname, cache=self.cache)
+		wd2 = world.load_new_world(self.fname, cache=self.cache)
+		self.assertNotEqual(wd2.source.fname, self.fname)
+		
+		wd2.put_tile(5, 5, tile.WallTile(wd2, 5, 5))
+		wd2.save_journal(self.fname)
+		self.assertTrue(os.path.exists(worldfile.get_journal_name(self.fname)))
+		self.assertEqual(os.path.getsize(self.fname), size)
+		
+		wd3 = world.load_new_world(self.fname, cache=self.cache)
+		self.assertTrue(isinstance(wd3.g[5][5], tile.WallTile))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import os, shutil, tempfile, unittest, struct, cStringIO
+
+import world, tile, worldfile
+from tests import maps
+
+def write_v1(wd, fname):
+	# nothing writes v1 any more, but this is all it ever was
+	fp = open(fname, "wb")
+	fp.write(worldfile.MAGIC_V1)
+	fp.write(struct.pack("<HH", wd.w, wd.h))
+	for row in wd.g:
+		for t in row:
+			fp.write(struct.pack("<h", tile.TILE_TYPE_IDS[t.save_type or t.tile_type]))
+			t.save(fp)
+	fp.close()
+
+def get_record(t):
+	# everything a world file keeps of a tile, extras and atmos included
+	fp = cStringIO.StringIO()
+	t.save(fp)
+	return (tile.TILE_TYPE_IDS[t.save_type or t.tile_type], fp.getvalue())
+
+class LoadTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.fname = os.path.join(self.path, "breach.wld")
+	
+	def tearDown(self):
+		shutil.rmtree(self.path)
+	
+	def assertSameWorld(self, a, b):
+		a.load_all_chunks()
+		b.load_all_chunks()
+		for y in xrange(a.h):
+			for x in xrange(a.w):
+				self.assertEqual(a.g[y][x].tile_type, b.g[y][x].tile_type, msg="tile differs at %i,%i" % (x, y))
+		for k in ("pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins", "heat_lvl"):
+			for i, (u, v) in enumerate(zip(getattr(a, k), getattr(b, k))):
+				self.assertEqual(u, v, msg="%s differs at %i,%i: %r %r" % (k, i%a.w, i//a.w, u, v))
+	
+	def test_lazy_and_streamed_match_eager(self):
+		# a room in the second column of chunks leaking out into the first,
+		# so the space it leaks into loads before the room does
+		wd = world.GameWorld(80, 40)
+		for y in xrange(5, 20):
+			for x in xrange(33, 60):
+				maps.put(wd, x, y, tile.WallTile if y in (5, 19) or x in (33, 59) else tile.FloorTile)
+		maps.put(wd, 33, 10, tile.FloorTile)
+		wd.g[10][40].add_pres(air=20.0)
+		ws = maps.NullScreen()
+		wd.tick_full(ws)
+		for n in xrange(30):
+			wd.tick(ws)
+		wd.save_world(self.fname)
+		self.assertGreater(wd.pres_lvl_air[wd.get_index(31, 10)], 0.0)
+		
+		eager = world.load_new_world(self.fname)
+		self.assertAlmostEqual(maps.total_gas(wd), maps.total_gas(eager), delta=1e-3)
+		
+		self.assertSameWorld(eager, world.load_new_world(self.fname, lazy=True))
+		
+		# a chunk at a time, in order
+		for streamed in world.stream_new_world(self.fname):
+			pass
+		self.assertSameWorld(eager, streamed)
+		
+		# the room's chunks first, then the space around it
+		lazy = world.load_new_world(self.fname, lazy=True)
+		lazy.load_region(32, 0, 48, 40)
+		self.assertSameWorld(eager, lazy)
+	
+	def test_lazy_open_only_fills_in_what_loads(self):
+		wd = world.GameWorld(200, 200)
+		for y in xrange(5, 20):
+			for x in xrange(5, 20):
+				maps.put(wd, x, y, tile.WallTile if y in (5, 19) or x in (5, 19) else tile.FloorTile)
+		wd.save_world(self.fname)
+		
+		lazy = world.load_new_world(self.fname, lazy=True)
+		self.assertFalse(any(lazy.rows_owned))
+		lazy.load_region(5, 5, 15, 15)
+		self.assertEqual([y for y in xrange(200) if lazy.rows_owned[y]], range(32))
+		self.assertTrue(lazy.g[100] is lazy.g[150])
+		
+		# a tile in the void gets the chunk tiles of their own, with nothing left over
+		t = maps.put(lazy, 100, 100, tile.FloorTile)
+		self.assertEqual(t.pres_lvl_air, tile.FloorTile.pres_lvl_air)
+		self.assertEqual(lazy.g[100][101].pres_flow, tile.DeepSpaceTile.pres_flow)
+		self.assertFalse(lazy.g[100] is lazy.g[150])
+		
+		lazy.save_world(self.fname)
+		again = world.load_new_world(self.fname)
+		self.assertEqual(get_record(again.g[100][100]), get_record(t))
+		self.assertEqual(again.g[100][101].pres_flow, tile.DeepSpaceTile.pres_flow)
+
+class FormatTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		
+		# every kind of tile, spread over a few chunks with some empty ones,
+		# with a door left open, a pump turned, something broken and gas moving about
+		wd, door, valve, pump = maps.build_rooms(70, 40)
+		door.on_touch()
+		pump.on_touch()
+		wd.g[19][12].become_broken()
+		wd.g[7][7].set_ch_col(ch="%", col=0x0c)
+		ws = maps.NullScreen()
+		wd.tick_full(ws)
+		for n in xrange(20):
+			wd.tick(ws)
+		self.wd = wd
+	
+	def tearDown(self):
+		shutil.rmtree(self.path)
+	
+	def check_loads(self, fname, sources):
+		# loads fname every way there is, and checks each one against what was saved.
+		# sources is what each of eager, lazy and streamed should be reading from.
+		a = self.wd
+		for streamed in world.stream_new_world(fname):
+			pass
+		loads = [
+			("eager", world.load_new_world(fname)),
+			("lazy", world.load_new_world(fname, lazy=True)),
+			("streamed", streamed),
+		]
+		for (how, b), src in zip(loads, sources):
+			self.assertEqual(b.source.__class__ if b.source != None else None, src, msg=how)
+			b.load_all_chunks()
+			for y in xrange(a.h):
+				for x in xrange(a.w):
+					self.assertEqual(get_record(a.g[y][x]), get_record(b.g[y][x]),
+						msg="%s load differs at %i,%i" % (how, x, y))
+			self.assertEqual(b.g[10][17].door_is_open, True)
+			self.assertEqual(b.g[12][22].pump_dir, 1)
+			self.assertEqual(b.g[12][22].pump_wiring, a.g[12][22].pump_wiring)
+	
+	def test_v1(self):
+		fname = os.path.join(self.path, "v1.wld")
+		write_v1(self.wd, fname)
+		self.check_loads(fname, [None, None, worldfile.StreamedWorldFile])
+	
+	def test_v2(self):
+		fname = os.path.join(self.path, "v2.wld")
+		worldfile.write_world_v2(self.wd, fname)
+		self.check_loads(fname, [None, worldfile.MappedWorldFile, worldfile.MappedWorldFile])
+	
+	def test_v3(self):
+		fname = os.path.join(self.path, "v3.wld")
+		self.wd.save_world(fname)
+		self.assertEqual(self.wd.source.__class__, worldfile.ChunkedWorldFile)
+		self.check_loads(fname, [worldfile.ChunkedWorldFile]*3)
+		
+		# only what changed gets compressed again, and the rest still loads the same
+		self.wd.put_tile(40, 30, tile.TankTile(self.wd, 40, 30))
+		self.wd.save_world(fname)
+		self.check_loads(fname, [worldfile.ChunkedWorldFile]*3)
+
+if __name__ == "__main__":
+	unittest.main()
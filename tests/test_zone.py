@@ -0,0 +1,94 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+
+import os, shutil, tempfile, unittest
+
+import world, tile
+from tests import maps
+
+class ZoneTest(unittest.TestCase):
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.fname = os.path.join(self.path, "room.wld")
+	
+	def tearDown(self):
+		shutil.rmtree(self.path)
+	
+	def test_disturbed_room_settles(self):
+		# a sealed 18x18 room, which the per-tile update leaves with a gradient across it
+		wd = world.GameWorld(30, 30)
+		for y in xrange(2, 22):
+			for x in xrange(2, 22):
+				maps.put(wd, x, y, tile.WallTile if y in (2, 21) or x in (2, 21) else tile.FloorTile)
+		ws = maps.NullScreen()
+		wd.tick_full(ws)
+		wd.save_world(self.fname)
+		
+		wd.g[12][12].add_pres(air=2.0)
+		i = wd.get_index(12, 12)
+		for n in xrange(500):
+			wd.tick(ws)
+			if wd.zones.is_settled(i):
+				break
+		self.assertTrue(wd.zones.is_settled(i))
+		
+		z = wd.zones.zones[wd.zones.zone_of[i]]
+		p = [wd.pres_lvl_air[j] for j in z.tiles]
+		self.assertAlmostEqual(min(p), max(p), delta=1e-9)
+		self.assertAlmostEqual(sum(p), 324.0+2.0, delta=1e-6)
+		
+		# the flattening has to make it into the journal like any other change
+		wd.save_journal(self.fname)
+		wd2 = world.load_new_world(self.fname)
+		for j in z.tiles:
+			self.assertAlmostEqual(wd.pres_lvl_air[j], wd2.pres_lvl_air[j], delta=1e-6)
+		
+		# and nothing in there needs looking at again
+		calls = []
+		get_atmos_delta = tile.Tile.get_atmos_delta
+		def counted(t, *nb):
+			calls.append(t.i)
+			return get_atmos_delta(t, *nb)
+		tile.Tile.get_atmos_delta = counted
+		try:
+			wd.tick_full(ws)
+		finally:
+			tile.Tile.get_atmos_delta = get_atmos_delta
+		self.assertTrue(calls)
+		self.assertFalse(z.tiles & set(calls))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -38,12 +38,98 @@ import struct
 from const import *
 import common
 
-class Tile:
+# per-tile atmos state which lives in the GameWorld arrays rather than on the tile
+ATMOS_FIELDS = [
+	"pres_lvl_air", "pres_lvl_plasma", "pres_lvl_toxins", "pres_flow",
+	"heat_lvl", "heat_flow",
+]
+
+# what a tile type can't override and still get its atmos done straight off the arrays,
+# see Tile.update_atmos_pres
+ATMOS_PLAIN_METHODS = [
+	"stress", "get_pres", "get_pres_air", "get_pres_plasma", "get_pres_toxins",
+	"get_heat", "change_pres", "collapse_pres",
+]
+
+class AtmosField(object):
+	# view onto one of the GameWorld atmos arrays
+	def __init__(self, name):
+		self.name = name
+	
+	def __get__(self, t, tc):
+		if t == None or t.world == None:
+			return tc.atmos_defaults[self.name]
+		
+		return getattr(t.world, self.name)[t.i]
+	
+	def __set__(self, t, v):
+		getattr(t.world, self.name)[t.i] = v
+
+class TileType(type):
+	# pulls the atmos defaults out of each class body into atmos_defaults,
+	# so subclasses can keep saying "pres_lvl_air = 4.0" without hiding the view.
+	#
+	# likewise the per-tile state (state_fields) gets pulled into state_defaults
+	# and each class only gets slots for the state it adds,
+	# so a tile is a small fixed-size thing with no __dict__.
+	# everything else on the class body is shared by every tile of that type.
+	#
+	# that includes the world, every world has its own subclass of each type
+	# for its tiles to be, see bind. tile_type is the type they're all a subclass of.
+	def __new__(mcs, name, bases, d):
+		defaults = {}
+		fields = ()
+		state = {}
+		for b in reversed(bases):
+			defaults.update(getattr(b, "atmos_defaults", {}))
+			fields += getattr(b, "state_fields", ())
+			state.update(getattr(b, "state_defaults", {}))
+		is_root = not defaults
+		
+		for k in ATMOS_FIELDS:
+			if k in d:
+				defaults[k] = d.pop(k)
+			if is_root:
+				d[k] = AtmosField(k)
+		
+		new_fields = tuple(d.pop("state_fields", ()))
+		fields += new_fields
+		for k in fields:
+			if k in d:
+				state[k] = d.pop(k)
+		
+		d["atmos_defaults"] = defaults
+		d["state_fields"] = fields
+		d["state_defaults"] = state
+		d["state_items"] = tuple(state.items())
+		d["__slots__"] = (("i",) if is_root else ()) + new_fields
+		tc = type.__new__(mcs, name, bases, d)
+		if "tile_type" not in d:
+			tc.tile_type = tc
+		return tc
+	
+	def bind(tc, world):
+		plain = not [k for k in ATMOS_PLAIN_METHODS
+			if getattr(tc, k).im_func is not getattr(Tile, k).im_func]
+		return TileType(tc.__name__, (tc,), {"world": world, "tile_type": tc, "atmos_plain": plain})
+
+class Tile(object):
+	__metaclass__ = TileType
+	
 	type_name = "EDOOFUS:defineme!"
+	state_fields = ("ch", "col", "solid", "broken") # per tile, see TileType
+	world = None # unless it's been bound to one, see TileType
 	ch = "?"
 	col = 0x07
 	solid = False
 	broken = False
+	zoned = True # can be part of an atmos zone if gas flows through it
+	structure = True # keeps the space around it simulated
+	atmos_sink = False # never simulated, swallows whatever flows in
+	atmos_frozen = False # never simulated, nothing flows in or out
+	atmos_plain = False # worked out when bound, see TileType
+	shared = False # one instance stands in for lots of positions
+	save_type = None # which type this gets saved as, if not itself
 	pres_lvl_air = 1.0
 	pres_lvl_plasma = 0.0
 	pres_lvl_toxins = 0.0
@@ -55,9 +141,29 @@ class Tile:
 	heat_lvl = 293.15 # 293.15 Kelvin == 20 Celcius
 	heat_flow = 0.9
 	
+	def __new__(tc, world, x, y):
+		if world != None:
+			tc = world.get_tile_type(tc)
+		return object.__new__(tc)
+	
 	def __init__(self, world, x, y):
-		self.world = world
-		self.x, self.y = x,y
+		for k, v in self.state_items:
+			setattr(self, k, v)
+		
+		if world != None:
+			self.i = world.get_index(x, y)
+			world.reset_atmos(self.i, self.atmos_defaults)
+		else:
+			self.i = -1
+	
+	# the position is worked out from the index rather than stored
+	@property
+	def x(self):
+		return -1 if self.world == None else self.i % self.world.w
+	
+	@property
+	def y(self):
+		return -1 if self.world == None else self.i // self.world.w
 	
 	def save(self, fp):
 		# store ch, col
@@ -65,10 +171,7 @@ class Tile:
 		fp.write(chr(ord(self.ch))+chr(self.col))
 		
 		# store flags
-		fp.write(chr(0
-			| (1 if self.solid else 0) # bit 0 = solid
-			| (2 if self.broken else 0) # bit 1 = broken
-		))
+		fp.write(chr(self.get_flags()))
 		
 		# store atmos crap
 		# note, floats must be used because pressure can get very, very high
@@ -85,9 +188,7 @@ class Tile:
 		self.col = ord(fp.read(1))
 		
 		# load flags
-		flags = ord(fp.read(1))
-		self.solid = not not (flags & 1) # bit 0 = solid
-		self.broken = not not (flags & 2) # bit 1 = broken
+		self.set_flags(ord(fp.read(1)))
 		
 		# load atmos crap
 		(
@@ -97,6 +198,8 @@ class Tile:
 		
 		# load anything else this tile needs
 		self.load_extra(fp)
+		
+		self.world.invalidate_stress(self.i)
 	
 	def save_extra(self, fp):
 		pass
@@ -104,14 +207,35 @@ class Tile:
 	def load_extra(self, fp):
 		pass
 	
+	def get_flags(self):
+		return (0
+			| (1 if self.solid else 0) # bit 0 = solid
+			| (2 if self.broken else 0) # bit 1 = broken
+		)
+	
+	def set_flags(self, flags):
+		self.solid = not not (flags & 1) # bit 0 = solid
+		self.broken = not not (flags & 2) # bit 1 = broken
+	
 	def become_broken(self):
 		self.solid = False
 		self.broken = True
 		self.pres_flow = 1.0
 		self.set_ch_col(ch=self.pres_tol_ch)
+		self.world.invalidate_tile(self.x, self.y)
 	
 	def stress(self, pt, (u,v)):
+		# below the leaking point the flow doesn't depend on pressure,
+		# so the world keeps it around until the pressure gets that high
+		w, i = self.world, self.i
+		if pt <= w.atmos_cond_max[i]:
+			return w.atmos_cond[i]
+		
+		return self.calc_stress(pt, (u,v))
+	
+	def calc_stress(self, pt, (u,v)):
 		if self.broken:
+			self.world.cache_stress(self.i, 1.0, float("inf"))
 			return 1.0
 		
 		f = self.get_pres_flow((u,v))
@@ -125,6 +249,10 @@ class Tile:
 				/(self.pres_tol_max-xmin)
 				+f
 			)
+		elif f < 1.0:
+			self.world.cache_stress(self.i, f, xmin/(1.0-f))
+		else:
+			self.world.cache_stress(self.i, f, float("inf"))
 		#ptf = pt*(1.0-f)
 		if ptf > self.pres_tol_max:
 			self.become_broken()
@@ -132,13 +260,19 @@ class Tile:
 		
 		return f
 	
-	def add_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
-		self.pres_lvl_air += air
-		self.pres_lvl_plasma += plasma
-		self.pres_lvl_toxins += toxins
-		self.heat_lvl += heat
+	def change_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
+		w, i = self.world, self.i
+		w.pres_lvl_air[i] += air
+		w.pres_lvl_plasma[i] += plasma
+		w.pres_lvl_toxins[i] += toxins
+		w.heat_lvl[i] += heat
 		
-		self.world.enqueue_atmos_update(self.x, self.y)
+		w.zones.wake(i)
+		w.dirty_tiles.add(i)
+	
+	def add_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
+		self.change_pres(air=air, plasma=plasma, toxins=toxins, heat=heat)
+		self.world.disturb_atmos(self.x, self.y)
 	
 	def set_ch_col(self, ch=None, col=None):
 		if ch != None:
@@ -147,8 +281,98 @@ class Tile:
 			self.col = col
 		
 		self.world.defer_draw_tile(self.x, self.y)
-	
-	def update_atmos_pres(self, tn, ts, tw, te):
+		self.world.mark_dirty(self.x, self.y)
+	
+	def update_atmos_pres(self):
+		w, i = self.world, self.i
+		ww = w.w
+		y, x = divmod(i, ww)
+		tn, ts, tw, te = w.get_neighbours(x, y)
+		if not (self.atmos_plain and tn.atmos_plain and ts.atmos_plain
+				and tw.atmos_plain and te.atmos_plain):
+			self.update_atmos_pres_from(tn, ts, tw, te)
+			return
+		
+		# the same as update_atmos_pres_from, read and written straight off the arrays
+		air, plasma, toxins, heat = w.pres_lvl_air, w.pres_lvl_plasma, w.pres_lvl_toxins, w.heat_lvl
+		cond, cond_max = w.atmos_cond, w.atmos_cond_max
+		jn, js, jw, je = i-ww, i+ww, i-1, i+1
+		
+		# get pressures
+		pc = air[i]+plasma[i]+toxins[i]
+		pn = air[jn]+plasma[jn]+toxins[jn]
+		ps = air[js]+plasma[js]+toxins[js]
+		pw = air[jw]+plasma[jw]+toxins[jw]
+		pe = air[je]+plasma[je]+toxins[je]
+		
+		# get flows
+		fc = cond[i] if pc <= cond_max[i] else self.calc_stress(pc, (0,0))
+		if fc == 0.0:
+			return
+		fn = cond[jn] if pn <= cond_max[jn] else tn.calc_stress(pn, DIR_LIST_NSWE[0])
+		fs = cond[js] if ps <= cond_max[js] else ts.calc_stress(ps, DIR_LIST_NSWE[1])
+		fw = cond[jw] if pw <= cond_max[jw] else tw.calc_stress(pw, DIR_LIST_NSWE[2])
+		fe = cond[je] if pe <= cond_max[je] else te.calc_stress(pe, DIR_LIST_NSWE[3])
+		
+		ftotal = fn+fs+fw+fe
+		if ftotal < ATMOS_MIN_FLOW:
+			return
+		
+		pctotal = pn*fn+ps*fs+pw*fw+pe*fe
+		ptotal = pc+pctotal
+		xftotal = ftotal+1.0
+		pmean = ptotal/xftotal
+		
+		pl_air = air[i]
+		pl_plasma = plasma[i]
+		pl_toxins = toxins[i]
+		pl_heat = heat[i]
+		
+		wake, dirty = w.zones.wake, w.dirty_tiles
+		d_air = d_plasma = d_toxins = d_heat = 0.0
+		
+		for t,j,p,(u,v) in zip((tn,ts,tw,te),(jn,js,jw,je),(pn,ps,pw,pe),DIR_LIST_NSWE):
+			c = (pmean-p)*fc*ATMOS_FLOW_ADJUST/5.0
+			
+			xd = p+pc
+			if xd >= ATMOS_MIN_MIX_PRESSURE:
+				xpl_air = (pl_air + air[j])/xd
+				xpl_plasma = (pl_plasma + plasma[j])/xd
+				xpl_toxins = (pl_toxins + toxins[j])/xd
+				xpl_heat = (pl_heat + heat[j])/xd
+				
+				pt = xd*c
+				c *= cond[j] if pt <= cond_max[j] else t.calc_stress(pt, (u,v))
+				air[j] += xpl_air*c
+				plasma[j] += xpl_plasma*c
+				toxins[j] += xpl_toxins*c
+				heat[j] += xpl_heat*c
+				wake(j)
+				dirty.add(j)
+				d_air -= xpl_air*c
+				d_plasma -= xpl_plasma*c
+				d_toxins -= xpl_toxins*c
+				d_heat -= xpl_heat*c
+			
+			for a in (air, plasma, toxins, heat):
+				if a[j] < ATMOS_MIN_PRESSURE and a[j] != 0.0:
+					a[j] = 0.0
+					dirty.add(j)
+		
+		air[i] += d_air
+		plasma[i] += d_plasma
+		toxins[i] += d_toxins
+		heat[i] += d_heat
+		wake(i)
+		dirty.add(i)
+		for a in (air, plasma, toxins, heat):
+			if a[i] < ATMOS_MIN_PRESSURE and a[i] != 0.0:
+				a[i] = 0.0
+		
+		for u,v in DIR_LIST_NSWE:
+			w.enqueue_atmos_update(x+u, y+v)
+	
+	def update_atmos_pres_from(self, tn, ts, tw, te):
 		# TODO: improve this algorithm
 		# there's a lot of "stuff i might need" in here
 		# which isn't actually used --GM
@@ -187,6 +411,9 @@ class Tile:
 		pl_toxins = self.get_pres_toxins()
 		pl_heat = self.get_heat() # TODO: split this into pressure and heat?
 		
+		# our side of every exchange gets applied in one go at the end
+		d_air = d_plasma = d_toxins = d_heat = 0.0
+		
 		for t,p,f,(u,v) in zip((tn,ts,tw,te),(pn,ps,pw,pe),(fn,fs,fw,fe),DIR_LIST_NSWE):
 			# calculate pressure to transfer
 			c = (pmean-p)*fc*ATMOS_FLOW_ADJUST/5.0
@@ -196,7 +423,6 @@ class Tile:
 			if xd < ATMOS_MIN_MIX_PRESSURE:
 				# the pressure is too low to work out the gas proportions
 				# don't transfer a damn thing
-				self.world.enqueue_atmos_update(t.x, t.y)
 				t.collapse_pres()
 				continue
 			
@@ -207,27 +433,61 @@ class Tile:
 			xpl_heat = (pl_heat + t.get_heat())/xd
 			
 			# transfer pressure
-			flow = t.stress(xd*c, (u,v))
-			t.add_pres(air=xpl_air*c*flow, plasma=xpl_plasma*c*flow, toxins=xpl_toxins*c*flow, heat=xpl_heat*c*flow)
-			c = -c
-			self.add_pres(air=xpl_air*c*flow, plasma=xpl_plasma*c*flow, toxins=xpl_toxins*c*flow, heat=xpl_heat*c*flow)
+			c *= t.stress(xd*c, (u,v))
+			t.change_pres(air=xpl_air*c, plasma=xpl_plasma*c, toxins=xpl_toxins*c, heat=xpl_heat*c)
+			d_air -= xpl_air*c
+			d_plasma -= xpl_plasma*c
+			d_toxins -= xpl_toxins*c
+			d_heat -= xpl_heat*c
 			t.collapse_pres()
 		
+		self.change_pres(air=d_air, plasma=d_plasma, toxins=d_toxins, heat=d_heat)
 		self.collapse_pres()
 		
-		self.world.enqueue_atmos_update(self.x, self.y)
+		# requeue everything we touched once, now that it's all settled down.
+		# the world takes care of requeueing us.
+		w, x, y = self.world, self.x, self.y
+		for u,v in DIR_LIST_NSWE:
+			w.enqueue_atmos_update(x+u, y+v)
 	
 	def collapse_pres(self):
-		if self.get_pres_air() < ATMOS_MIN_PRESSURE:
-			self.pres_lvl_air = 0.0
-		if self.get_pres_plasma() < ATMOS_MIN_PRESSURE:
-			self.pres_lvl_plasma = 0.0
-		if self.get_pres_toxins() < ATMOS_MIN_PRESSURE:
-			self.pres_lvl_toxins = 0.0
-		if self.get_heat() < ATMOS_MIN_PRESSURE:
-			self.heat_lvl = 0.0
-	
-	def get_atmos_delta(self, tn, ts, tw, te):
+		w, i = self.world, self.i
+		for a in (w.pres_lvl_air, w.pres_lvl_plasma, w.pres_lvl_toxins, w.heat_lvl):
+			if a[i] < ATMOS_MIN_PRESSURE and a[i] != 0.0:
+				a[i] = 0.0
+				w.dirty_tiles.add(i)
+	
+	def get_atmos_delta(self):
+		w, i = self.world, self.i
+		ww = w.w
+		y, x = divmod(i, ww)
+		tn, ts, tw, te = w.get_neighbours(x, y)
+		if not (self.atmos_plain and tn.atmos_plain and ts.atmos_plain
+				and tw.atmos_plain and te.atmos_plain):
+			return self.get_atmos_delta_from(tn, ts, tw, te)
+		
+		# the same as get_atmos_delta_from, read straight off the arrays
+		air, plasma, toxins = w.pres_lvl_air, w.pres_lvl_plasma, w.pres_lvl_toxins
+		cond, cond_max = w.atmos_cond, w.atmos_cond_max
+		jn, js, jw, je = i-ww, i+ww, i-1, i+1
+		
+		pc = air[i]+plasma[i]+toxins[i]
+		fc = cond[i] if pc <= cond_max[i] else self.calc_stress(pc, (0,0))
+		if fc == 0.0:
+			return 0.0
+		
+		pt = pc*ATMOS_FLOW_ADJUST/5.0
+		fn = cond[jn] if pt <= cond_max[jn] else tn.calc_stress(pt, DIR_LIST_NSWE[0])
+		fs = cond[js] if pt <= cond_max[js] else ts.calc_stress(pt, DIR_LIST_NSWE[1])
+		fw = cond[jw] if pt <= cond_max[jw] else tw.calc_stress(pt, DIR_LIST_NSWE[2])
+		fe = cond[je] if pt <= cond_max[je] else te.calc_stress(pt, DIR_LIST_NSWE[3])
+		
+		return (abs(air[jn]+plasma[jn]+toxins[jn]-pc)*fn
+			+ abs(air[js]+plasma[js]+toxins[js]-pc)*fs
+			+ abs(air[jw]+plasma[jw]+toxins[jw]-pc)*fw
+			+ abs(air[je]+plasma[je]+toxins[je]-pc)*fe)*fc
+	
+	def get_atmos_delta_from(self, tn, ts, tw, te):
 		# get pressures
 		pc = self.get_pres((0,0))
 		pn, ps, pw, pe = (t.get_pres((u,v)) for t,(u,v) in zip((tn,ts,tw,te),DIR_LIST_NSWE) )
@@ -244,19 +504,20 @@ class Tile:
 		return (abs(pn-pc)*fn + abs(ps-pc)*fs + abs(pw-pc)*fw + abs(pe-pc)*fe)*fc
 	
 	def get_pres(self, (u,v)=(None,None)):
-		return self.get_pres_air() + self.get_pres_plasma() + self.get_pres_toxins()
+		w, i = self.world, self.i
+		return w.pres_lvl_air[i] + w.pres_lvl_plasma[i] + w.pres_lvl_toxins[i]
 	
 	def get_pres_air(self):
-		return self.pres_lvl_air
+		return self.world.pres_lvl_air[self.i]
 	
 	def get_pres_plasma(self):
-		return self.pres_lvl_plasma
+		return self.world.pres_lvl_plasma[self.i]
 	
 	def get_pres_toxins(self):
-		return self.pres_lvl_toxins
+		return self.world.pres_lvl_toxins[self.i]
 	
 	def get_pres_flow(self, (u,v)=(None,None)):
-		r = self.pres_flow
+		r = self.world.pres_flow[self.i]
 		
 		if r <= 0.000001:
 			return 0
@@ -264,10 +525,10 @@ class Tile:
 		return r
 	
 	def get_heat(self):
-		return self.heat_lvl
+		return self.world.heat_lvl[self.i]
 	
 	def get_heat_flow(self):
-		v = self.heat_flow
+		v = self.world.heat_flow[self.i]
 		
 		if v <= 0.000001:
 			return 0
@@ -294,18 +555,107 @@ class SpaceTile(Tile):
 	type_name = "Space"
 	ch = " "
 	solid = False
+	structure = False
 	pres_lvl_air = 0.0
 	pres_tol_min = 4.0
 	pres_tol_max = 15.0
 	heat_lvl = 0.0
 
-class BorderTile(SpaceTile):
+class DeepSpaceTile(SpaceTile):
+	# open space far enough from anything that we don't simulate it.
+	# gas that flows in here is simply gone.
+	zoned = False
+	structure = False
+	atmos_sink = True
+	save_type = SpaceTile
+	
+	def change_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
+		return
+	
+	def add_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
+		return
+	
+	def get_pres(self, (u,v)=(None,None)):
+		return 0.0
+	
+	def get_pres_air(self):
+		return 0.0
+	
+	def get_pres_plasma(self):
+		return 0.0
+	
+	def get_pres_toxins(self):
+		return 0.0
+	
+	def get_heat(self):
+		return 0.0
+	
+	def get_editables(self):
+		return {}
+
+class BorderTile(DeepSpaceTile):
+	type_name = "Border"
+	solid = True
+	save_type = None
+
+class VoidTile(DeepSpaceTile):
+	# every tile of deep space in a chunk with nothing else in it is this one tile,
+	# see GameWorld.alloc_chunk. it never changes, so nothing gets allocated for it.
+	shared = True
+	real_type = DeepSpaceTile # what it turns into once its chunk gets allocated
+	
+	def stress(self, pt, (u,v)):
+		return self.get_pres_flow()
+	
+	def collapse_pres(self):
+		return
+	
+	def get_pres_flow(self, (u,v)=(None,None)):
+		return self.pres_flow
+	
+	def get_heat_flow(self):
+		return self.heat_flow
+	
+	def set_ch_col(self, ch=None, col=None):
+		return
+	
+	def become_broken(self):
+		return
+
+class VoidBorderTile(VoidTile):
 	type_name = "Border"
 	solid = True
+	save_type = BorderTile
+	real_type = BorderTile
+
+class UnloadedTile(Tile):
+	# every tile of a chunk that hasn't been loaded yet is this one tile.
+	# the world loads the chunk before anything gets to change it.
+	type_name = "Unloaded"
+	ch = "?"
+	col = 0x08
+	solid = True
+	zoned = False
+	structure = False # whatever is in there sorts out the space around it once it loads
+	atmos_frozen = True
+	shared = True
+	pres_flow = 0.0
+	
+	def stress(self, pt, (u,v)):
+		return 0.0
+	
+	def change_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
+		return
 	
 	def add_pres(self, air=0.0, plasma=0.0, toxins=0.0, heat=0.0):
 		return
 	
+	def collapse_pres(self):
+		return
+	
+	def get_pres(self, (u,v)=(None,None)):
+		return 0.0
+	
 	def get_pres_air(self):
 		return 0.0
 	
@@ -315,9 +665,15 @@ class BorderTile(SpaceTile):
 	def get_pres_toxins(self):
 		return 0.0
 	
+	def get_pres_flow(self, (u,v)=(None,None)):
+		return 0
+	
 	def get_heat(self):
 		return 0.0
 	
+	def get_heat_flow(self):
+		return 0
+	
 	def get_editables(self):
 		return {}
 
@@ -345,6 +701,7 @@ class DoorTile(Tile):
 	pres_flow = 0.0
 	heat_flow = 0.0
 	
+	state_fields = ("door_is_open",)
 	door_is_open = False
 	
 	def save_extra(self, fp):
@@ -376,7 +733,11 @@ class DoorTile(Tile):
 			self.pres_flow = 0.0
 			self.heat_flow = 0.0
 		
-		self.world.enqueue_atmos_update(self.x, self.y)
+		if self.door_is_open:
+			self.world.on_zone_opened(self.x, self.y)
+		else:
+			self.world.invalidate_tile(self.x, self.y)
+		self.world.disturb_atmos(self.x, self.y)
 
 class ValveTile(Tile):
 	type_name = "Valve"
@@ -389,6 +750,7 @@ class ValveTile(Tile):
 	pres_tol_max = 6.0
 	pres_tol_leakmax = 0.7
 	
+	state_fields = ("valve_is_open",)
 	valve_is_open = False
 	
 	def save_extra(self, fp):
@@ -418,7 +780,11 @@ class ValveTile(Tile):
 			self.pres_flow = 0.0
 			self.heat_flow = 0.0
 		
-		self.world.enqueue_atmos_update(self.x, self.y)
+		if self.valve_is_open:
+			self.world.on_zone_opened(self.x, self.y)
+		else:
+			self.world.invalidate_tile(self.x, self.y)
+		self.world.disturb_atmos(self.x, self.y)
 
 class TankTile(Tile):
 	type_name = "Tank"
@@ -441,8 +807,11 @@ class PumpTile(Tile):
 	pres_tol_min = 100.0
 	pres_tol_max = 150.0
 	pres_tol_leakmax = 0.04
+	zoned = False # directional, so always simulated per tile
 	
+	state_fields = ("pump_dir", "pump_wiring")
 	pump_dir = 0 # North
+	pump_wiring = DIR_LIST_NSWE[0] # zu,zv
 	
 	def save_extra(self, fp):
 		# pump direction
@@ -451,29 +820,27 @@ class PumpTile(Tile):
 	def load_extra(self, fp):
 		# pump direction
 		self.pump_dir = ord(fp.read(1))
+		self.wire_pump()
+	
+	def wire_pump(self):
+		self.pump_wiring = DIR_LIST_NSWE[self.pump_dir]
 	
 	def on_touch(self, entity=None, item=None):
 		if self.broken:
 			return
 		
 		self.pump_dir = (self.pump_dir+1)&3
+		self.wire_pump()
 		self.set_ch_col(ch="^v<>"[self.pump_dir])
 		
-		self.world.enqueue_atmos_update(self.x, self.y)
+		self.world.disturb_atmos(self.x, self.y)
 	
-	def pump_get_params(self):
-		zu,zv = DIR_LIST_NSWE[self.pump_dir]
-		to = self.world.g[self.y+zv][self.x+zu]
-		ti = self.world.g[self.y-zv][self.x-zu]
-		po = to.get_pres((-zu,-zv))
-		pi = to.get_pres((zu,zv))
-		fo = to.get_pres_flow((-zu,-zv))
-		fi = to.get_pres_flow((zu,zv))
-		
-		return zu,zv,to,ti,po,pi,fo,fi
+	def stress(self, pt, (u,v)):
+		# our flow depends on direction, so it can't be cached
+		return self.calc_stress(pt, (u,v))
 	
 	def get_pres(self, (u,v)=(None,None)):
-		zu,zv,to,ti,po,pi,fo,fi = self.pump_get_params()
+		zu,zv = self.pump_wiring
 		
 		rp = Tile.get_pres(self,(u,v))
 		
@@ -485,7 +852,7 @@ class PumpTile(Tile):
 			return rp
 	
 	def get_pres_flow(self, (u,v)=(None,None)):
-		zu,zv,to,ti,po,pi,fo,fi = self.pump_get_params()
+		zu,zv = self.pump_wiring
 		
 		if u == None or (zu == 0) == (u == 0) or ((u == 0) and (v == 0)):
 			return self.pres_flow
@@ -498,5 +865,17 @@ TILE_TYPES = [
 	PumpTile,
 ]
 
+# what gets written to world files, the border never changes so it's just -1
+TILE_TYPE_IDS = dict((tc, i) for i, tc in enumerate(TILE_TYPES))
+TILE_TYPE_IDS[BorderTile] = -1
+
+UNLOADED_TILE = UnloadedTile(None, -1, -1)
+
+# the shared stand-in for each kind of tile an unallocated chunk can have
+VOID_TILES = {
+	DeepSpaceTile: VoidTile(None, -1, -1),
+	BorderTile: VoidBorderTile(None, -1, -1),
+}
+
 TILE_EXAMPLES = [t(None,-1,-1) for t in TILE_TYPES]
 
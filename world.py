@@ -33,123 +33,736 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 
-import struct, heapq
+import os, array, time
 
 from const import *
 import common
 import tile, entity
+import atmosgrid, zone, pqueue, worldfile
 
-def load_new_world(fname):
-	fp = open(fname, "rb")
+def load_new_world(fname, lazy=False, cache=None):
+	# with lazy set, a v2 or v3 world gets memory-mapped and its tiles
+	# are only read in as they're needed, see GameWorld.load_chunk.
+	# only the tiles are lazy, the per-tile arrays still cover the whole map,
+	# see GameWorld.__init__.
+	# with cache set (a worldcache.WorldCache), anything that
+	# has to be parsed in one go only gets parsed the first time.
+	world = cache.load(fname, lazy) if cache != None else None
+	if world == None:
+		world = open_world(fname, lazy)
+		worldfile.replay_journal(world, fname)
+		if cache != None and CHUNK_UNLOADED not in world.chunk_state:
+			cache.store(fname, world)
 	
-	magic = fp.read(8)
-	if magic != "SS3-14\x1A\x01":
-		raise WorldFormatException("not an SS3-14 v1 world")
+	# a cached world's source is the cache's copy, but it still saves to fname
+	world.fname = fname
+	world.dirty_tiles = set()
 	
-	w, h = struct.unpack("<HH", fp.read(4))
-	world = GameWorld(w, h)
+	# whatever got saved mid-flow can jump straight to where it was headed
+	world.atmos_presolve = True
 	
-	for y in xrange(h):
-		for x in xrange(w):
-			tt, = struct.unpack("<h",fp.read(2))
-			tc = tile.BorderTile if tt == -1 else tile.TILE_TYPES[tt]
-			t = tc(world, x, y)
-			t.load(fp)
-			world.g[y][x] = t
+	return world
+
+def stream_new_world(fname, progress=None, cache=None):
+	# load_new_world, a chunk at a time. this yields the world as soon as there is one,
+	# then again after every chunk, so whoever's loading it can get on with
+	# drawing it and taking input in between. chunks that haven't loaded yet
+	# are frozen in place like the border, so the rest can already be simulated.
+	# progress, if set, gets called after every chunk with the bytes read
+	# and tiles loaded so far, and how many of each there are altogether.
+	world = cache.load(fname, lazy=True) if cache != None else None
+	cached = world != None
+	if world == None:
+		src = worldfile.stream_world(fname)
+		if src == None:
+			# this one has to be read in one go
+			yield load_new_world(fname, cache=cache)
+			return
+		
+		world = GameWorld(src.w, src.h, src)
+		worldfile.replay_journal(world, fname)
+	
+	world.fname = fname
+	world.dirty_tiles = set()
+	world.atmos_presolve = True
+	yield world
 	
-	fp.close()
+	src = world.source
+	tiles = 0
+	for cy in xrange(world.chunks_h):
+		for cx in xrange(world.chunks_w):
+			x0, y0, x1, y1 = world.get_chunk_rect(cx, cy)
+			tiles += (x1-x0)*(y1-y0)
+			if world.chunk_state[cy*world.chunks_w+cx] != CHUNK_UNLOADED:
+				continue # the journal or the caller got to it first
+			
+			world.load_chunk(cx, cy)
+			if progress != None:
+				progress(src.bytes_read, src.total_bytes, tiles, world.w*world.h)
+			yield world
 	
+	# only a v1 world is worth caching, the rest load like this anyway.
+	# it has to still be what's in the file, so not if anything's been ticked or changed.
+	if (cache != None and not cached and isinstance(src, worldfile.StreamedWorldFile)
+			and world.ftime == 0 and not world.dirty_tiles):
+		cache.store(fname, world)
+
+def open_world(fname, lazy=False):
+	# same as load_new_world, but just the file itself
+	src = worldfile.map_world(fname) if lazy else None
+	if src != None:
+		return GameWorld(src.w, src.h, src)
+	
+	world = worldfile.read_world(fname)
+	world.update_space_sinks()
+	world.free_void_chunks()
 	return world
 
 class GameWorld:
 	class WorldFormatException(Exception):
 		pass
 	
+	class AtmosEngineException(Exception):
+		pass
+	
 	ftime = 0
+	space_sink_dist = ATMOS_SPACE_SINK_DIST
 	
-	def __init__(self, w, h):
+	def __init__(self, w, h, source=None):
 		self.w, self.h = w, h
 		
+		# see get_tile_type
+		self.tile_types = {}
+		
 		self.pressure_view = False
 		
-		self.atmos_queue = []
-		self.atmos_set = set()
+		self.atmos_engine = "tile"
+		self.grid_engine = None
+		self.zone_solver = None
+		
+		# if set, the next tick_full solves every zone outright first
+		self.atmos_presolve = False
+		
+		# if set, tick runs atmos updates for this long instead of a fixed count
+		self.atmos_budget_ms = None
+		self.atmos_tick_updates = 0
+		self.atmos_tick_ms = 0.0
+		
+		self.atmos_queue = pqueue.IndexedHeap()
+		
+		# get_atmos_delta of everything queued as of when it was queued, and the sum of those.
+		# this is how far the world is from having settled down.
+		self.atmos_delta = {}
+		self.atmos_residual = 0.0
 		
 		self.draw_queue = []
 		self.draw_set = set()
-		self.g = (
-			  [[tile.BorderTile(self,x,0) for x in xrange(w)]]
-			+ [[tile.BorderTile(self,0,y+1)]+[tile.SpaceTile(self,x+1,y+1) for x in xrange(w-2)]+[tile.BorderTile(self,w-1,y+1)]
-				for y in xrange(h-2)]
-			+ [[tile.BorderTile(self,x,h-1) for x in xrange(w)]]
-		)
+		
+		# the x,y,w,h of the world that gets drawn, which goes in the top left
+		# of whatever it's drawn on. None draws all of it where it is.
+		self.view = None
+		# set whenever anything gets drawn, for whoever shows it to clear
+		self.view_dirty = False
+		# what was last drawn in each cell of the view, 0 if unknown.
+		# None until something gets drawn, see put_glyph
+		self.view_glyphs = None
+		# tile class -> get_twogradient_table for its pressure tolerances
+		self.pres_glyph_tables = {}
+		
+		# tile indices changed since the last save, see save_journal
+		self.dirty_tiles = set()
+		# the file we were loaded from or last saved to
+		self.fname = None
+		
+		# the save running in the background, see save_world_background
+		self.save_job = None
+		self.save_result = None
+		
+		# atmos state, one flat array per field, indexed by get_index(x,y)
+		# the tiles themselves only hold a view onto these.
+		#
+		# only the chunks with tiles of their own have anything in them,
+		# the shared tiles everywhere else say what's there themselves.
+		# the rest never gets written to, so it never takes up any memory,
+		# see common.lazy_array. that goes for the zone map as well.
+		n = w*h
+		for k in tile.ATMOS_FIELDS:
+			setattr(self, k, common.lazy_array("d", n))
+		
+		# cached Tile.stress results, good up to atmos_cond_max
+		self.atmos_cond = common.lazy_array("d", n)
+		self.atmos_cond_max = common.lazy_array("d", n)
+		
+		# tiles come in a chunk at a time from source, if there is one.
+		# until then they're all the same UnloadedTile.
+		# chunks of nothing but deep space don't get tiles of their own, see alloc_chunk.
+		self.source = source
+		self.chunks_w = (w+WORLD_CHUNK_SIZE-1)//WORLD_CHUNK_SIZE
+		self.chunks_h = (h+WORLD_CHUNK_SIZE-1)//WORLD_CHUNK_SIZE
+		self.chunk_state = bytearray([CHUNK_VOID if source == None else CHUNK_UNLOADED])*(self.chunks_w*self.chunks_h)
+		
+		# rows of g that are all the same are the same list,
+		# until a chunk on them gets tiles of its own, see own_rows
+		self.rows_owned = bytearray(h)
+		if source != None:
+			self.g = [[tile.UNLOADED_TILE]*w]*h
+		else:
+			# with nothing built yet, all of space is far away from everything
+			vb = tile.VOID_TILES[tile.BorderTile]
+			vd = tile.VOID_TILES[tile.DeepSpaceTile]
+			self.g = [[vb]*w] + [[vb]+[vd]*(w-2)+[vb]]*(h-2) + [[vb]*w]
+		
+		self.zones = zone.ZoneMap(self)
+		
+		if source == None and self.space_sink_dist == None:
+			# all of space gets simulated, so none of it can be left out
+			self.update_space_sinks()
+	
+	def get_chunk_rect(self, cx, cy):
+		# x0,y0,x1,y1 of the tiles in chunk cx,cy, exclusive at the far end
+		x0, y0 = cx*WORLD_CHUNK_SIZE, cy*WORLD_CHUNK_SIZE
+		return x0, y0, min(self.w, x0+WORLD_CHUNK_SIZE), min(self.h, y0+WORLD_CHUNK_SIZE)
+	
+	def get_chunk_index(self, x, y):
+		return (y//WORLD_CHUNK_SIZE)*self.chunks_w+x//WORLD_CHUNK_SIZE
+	
+	def get_loaded_rects(self, border=True, within=None):
+		# the chunks with tiles of their own, which is all that needs looking at.
+		# without border, the outside ring of the map is left out.
+		# within cuts them down to the x0,y0,x1,y1 given.
+		bx0, by0, bx1, by1 = (0, 0, self.w, self.h) if border else (1, 1, self.w-1, self.h-1)
+		if within != None:
+			bx0, by0 = max(bx0, within[0]), max(by0, within[1])
+			bx1, by1 = min(bx1, within[2]), min(by1, within[3])
+		
+		l = []
+		for cy in xrange(by0//WORLD_CHUNK_SIZE, (by1-1)//WORLD_CHUNK_SIZE+1):
+			for cx in xrange(bx0//WORLD_CHUNK_SIZE, (bx1-1)//WORLD_CHUNK_SIZE+1):
+				if self.chunk_state[cy*self.chunks_w+cx] == CHUNK_ALLOCATED:
+					x0, y0, x1, y1 = self.get_chunk_rect(cx, cy)
+					x0, y0 = max(bx0, x0), max(by0, y0)
+					x1, y1 = min(bx1, x1), min(by1, y1)
+					if x0 < x1 and y0 < y1:
+						l.append((x0, y0, x1, y1))
+		
+		return l
+	
+	def get_tile(self, x, y):
+		# same as g[y][x], but makes sure it's actually been loaded.
+		# this can still be one of the void tiles, which never change.
+		if self.chunk_state[self.get_chunk_index(x, y)] == CHUNK_UNLOADED:
+			self.load_chunk(x//WORLD_CHUNK_SIZE, y//WORLD_CHUNK_SIZE)
+		
+		return self.g[y][x]
+	
+	def load_region(self, x, y, w, h):
+		for cy in xrange(max(0, y//WORLD_CHUNK_SIZE), min(self.chunks_h, (y+h-1)//WORLD_CHUNK_SIZE+1)):
+			for cx in xrange(max(0, x//WORLD_CHUNK_SIZE), min(self.chunks_w, (x+w-1)//WORLD_CHUNK_SIZE+1)):
+				self.load_chunk(cx, cy)
+	
+	def load_all_chunks(self):
+		self.load_region(0, 0, self.w, self.h)
+	
+	def load_chunk(self, cx, cy):
+		k = cy*self.chunks_w+cx
+		if self.chunk_state[k] != CHUNK_UNLOADED:
+			return
+		
+		self.chunk_state[k] = CHUNK_ALLOCATED
+		x0, y0, x1, y1 = self.get_chunk_rect(cx, cy)
+		self.own_rows(y0, y1)
+		self.source.load_tiles(self, x0, y0, x1, y1)
+		
+		# sort out the space before any of it can end up in a zone.
+		# space next door that was only kept around in case this turned out
+		# to be a structure can leave those chunks empty as well.
+		self.update_space_sinks_in(x0, y0, x1, y1)
+		for ncy in xrange(max(0, cy-1), min(self.chunks_h, cy+2)):
+			for ncx in xrange(max(0, cx-1), min(self.chunks_w, cx+2)):
+				nk = ncy*self.chunks_w+ncx
+				if nk != k and self.chunk_state[nk] == CHUNK_ALLOCATED and self.is_void_chunk(ncx, ncy):
+					self.free_chunk(ncx, ncy)
+		if self.is_void_chunk(cx, cy):
+			self.free_chunk(cx, cy)
+			return
+		
+		self.add_chunk(cx, cy)
+	
+	def alloc_chunk(self, cx, cy):
+		# gives a void chunk tiles of its own, so they can be changed
+		k = cy*self.chunks_w+cx
+		if self.chunk_state[k] != CHUNK_VOID:
+			return
+		
+		self.chunk_state[k] = CHUNK_ALLOCATED
+		x0, y0, x1, y1 = self.get_chunk_rect(cx, cy)
+		self.own_rows(y0, y1)
+		for y in xrange(y0, y1):
+			row = self.g[y]
+			for x in xrange(x0, x1):
+				row[x] = row[x].real_type(self, x, y)
+		
+		self.add_chunk(cx, cy)
+	
+	def alloc_all_chunks(self):
+		for cy in xrange(self.chunks_h):
+			for cx in xrange(self.chunks_w):
+				self.alloc_chunk(cx, cy)
+	
+	def claim_tiles(self, x0, y, x1):
+		# a loader is about to put tiles along row y from x0 to x1 straight into g
+		for cx in xrange(x0//WORLD_CHUNK_SIZE, (x1-1)//WORLD_CHUNK_SIZE+1):
+			self.chunk_state[(y//WORLD_CHUNK_SIZE)*self.chunks_w+cx] = CHUNK_ALLOCATED
+		self.own_rows(y, y+1)
+	
+	def own_rows(self, y0, y1):
+		# gives rows y0 to y1 of g a list of their own, so tiles can be put in them
+		for y in xrange(y0, y1):
+			if not self.rows_owned[y]:
+				self.g[y] = list(self.g[y])
+				self.rows_owned[y] = 1
+	
+	def is_void_chunk(self, cx, cy):
+		# nothing but untouched deep space, which the void tiles can stand in for
+		x0, y0, x1, y1 = self.get_chunk_rect(cx, cy)
+		for y in xrange(y0, y1):
+			for t in self.g[y][x0:x1]:
+				v = tile.VOID_TILES.get(t.tile_type)
+				if v == None or (t.ch, t.col, t.get_flags()) != (v.ch, v.col, v.get_flags()):
+					return False
+			
+			# whatever came out of a file has been through a float
+			i0, i1 = self.get_index(x0, y), self.get_index(x1, y)
+			for k, v in tile.DeepSpaceTile.atmos_defaults.iteritems():
+				a = getattr(self, k)[i0:i1]
+				fv = array.array("f", [v])[0]
+				if a.count(v) + (a.count(fv) if fv != v else 0) != i1-i0:
+					return False
+		
+		return True
+	
+	def free_chunk(self, cx, cy):
+		# swaps the tiles of a void chunk for the shared ones
+		x0, y0, x1, y1 = self.get_chunk_rect(cx, cy)
+		for y in xrange(y0, y1):
+			row = self.g[y]
+			for x in xrange(x0, x1):
+				row[x] = tile.VOID_TILES[row[x].tile_type]
+		
+		self.chunk_state[cy*self.chunks_w+cx] = CHUNK_VOID
+		if self.grid_engine != None:
+			self.grid_engine.invalidate_rect(x0, y0, x1, y1)
+	
+	def free_void_chunks(self):
+		for cy in xrange(self.chunks_h):
+			for cx in xrange(self.chunks_w):
+				if self.chunk_state[cy*self.chunks_w+cx] == CHUNK_ALLOCATED and self.is_void_chunk(cx, cy):
+					self.free_chunk(cx, cy)
+	
+	def add_chunk(self, cx, cy):
+		# the chunk has just got tiles of its own, let everything else know
+		x0, y0, x1, y1 = self.get_chunk_rect(cx, cy)
+		if self.grid_engine != None:
+			self.grid_engine.invalidate_rect(x0, y0, x1, y1)
+		for y in xrange(y0, y1):
+			for x in xrange(x0, x1):
+				self.zones.retile(self.get_index(x, y))
+		for y in xrange(y0, y1):
+			for x in xrange(x0, x1):
+				self.enqueue_atmos_update(x, y)
+				self.defer_draw_tile(x, y)
 	
 	def save_world(self, fname):
-		fp = open(fname, "wb")
-		fp.write("SS3-14\x1A\x01")
-		fp.write(struct.pack("<HH", self.w, self.h))
+		# anything not loaded yet gets copied over from the old file,
+		# and the new one takes over from it
+		self.wait_save()
+		old = self.source
+		self.source = worldfile.write_world(self, fname)
+		self.fname = fname
+		self.dirty_tiles = set()
+		if old != None:
+			old.close()
+	
+	def save_journal(self, fname):
+		# only writes out the tiles that changed, as long as fname
+		# is what we were loaded from or last saved to.
+		# the source can be a cached copy of fname plus its journal,
+		# which is still what the journal goes on top of.
+		self.wait_save()
+		if self.source == None or self.fname != fname:
+			return self.save_world(fname)
+		
+		worldfile.append_journal(self, fname, sorted(self.dirty_tiles))
+		self.dirty_tiles = set()
+	
+	def save_world_background(self, fname):
+		# same as save_world, but done by a forked copy of us,
+		# which gets a snapshot of the whole world for free.
+		# returns False if there's already a save going. see poll_save.
+		if self.save_job != None:
+			return False
+		
+		if not hasattr(os, "fork"):
+			try:
+				self.save_world(fname)
+				self.save_result = (True, None)
+			except Exception, e:
+				self.save_result = (False, str(e))
+			return True
+		
+		# the fork would share whatever we share with the parallel engine's workers,
+		# rather than get a snapshot of it
+		shared = self.grid_engine.copy_shared_arrays() if self.grid_engine != None else {}
+		
+		rfd, wfd = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			# never come back out of here, the parent owns everything
+			os.close(rfd)
+			for k, a in shared.iteritems():
+				setattr(self, k, a)
+			try:
+				worldfile.write_world(self, fname).close()
+				os._exit(0)
+			except BaseException, e:
+				os.write(wfd, str(e) or e.__class__.__name__)
+				os._exit(1)
+		
+		os.close(wfd)
+		self.save_job = (pid, rfd, fname, self.dirty_tiles)
+		self.dirty_tiles = set()
+		return True
+	
+	def poll_save(self):
+		# None if there's nothing new to report,
+		# otherwise (True, None) once a save is done or (False, why) if it failed
+		if self.save_job == None:
+			r, self.save_result = self.save_result, None
+			return r
+		
+		pid, status = os.waitpid(self.save_job[0], os.WNOHANG)
+		if pid == 0:
+			return None
+		
+		return self.finish_save(status)
+	
+	def wait_save(self):
+		if self.save_job != None:
+			pid, status = os.waitpid(self.save_job[0], 0)
+			self.save_result = self.finish_save(status)
+	
+	def finish_save(self, status):
+		pid, rfd, fname, dirty = self.save_job
+		self.save_job = None
+		msg = os.read(rfd, 4096)
+		os.close(rfd)
+		
+		if status != 0:
+			# whatever it was meant to save still needs saving
+			self.dirty_tiles |= dirty
+			return (False, msg or "save exited with status %i" % status)
 		
-		for y in xrange(self.h):
-			for x in xrange(self.w):
-				t = self.g[y][x]
-				tc = t.__class__
-				tt = -1 if tc == tile.BorderTile else tile.TILE_TYPES.index(tc)
-				fp.write(struct.pack("<h", tt))
-				t.save(fp)
+		old = self.source
+		self.source = worldfile.map_world(fname)
+		self.fname = fname
+		if old != None:
+			old.close()
 		
-		fp.close()
+		return (True, None)
+	
+	def mark_dirty(self, x, y):
+		self.dirty_tiles.add(self.get_index(x, y))
+	
+	def set_atmos_engine(self, name):
+		# "tile" is the queued per-tile update, "grid" does the whole map each tick,
+		# "parallel" is "grid" spread over a process pool
+		if name not in ("tile", "grid", "parallel"):
+			raise self.AtmosEngineException("unknown atmos engine %s" % repr(name))
+		if name != "tile" and not atmosgrid.available():
+			raise self.AtmosEngineException("%s atmos engine needs numpy" % name)
+		
+		if self.atmos_engine == "parallel" and name != "parallel":
+			self.grid_engine.close()
+			self.grid_engine = None
+		
+		if name == "grid" and self.atmos_engine != "grid":
+			self.grid_engine = atmosgrid.GridEngine(self)
+		elif name == "parallel" and self.atmos_engine != "parallel":
+			self.grid_engine = atmosgrid.ParallelGridEngine(self)
+		
+		if name == "tile" and self.atmos_engine != "tile":
+			# the grid engines keep the queue empty, so it has to start over
+			self.grid_engine = None
+			self.clear_atmos_queue()
+			for x0, y0, x1, y1 in self.get_loaded_rects(border=False):
+				for y in xrange(y0, y1):
+					for x in xrange(x0, x1):
+						self.enqueue_atmos_update(x, y)
+		
+		self.atmos_engine = name
+	
+	def set_space_sink_dist(self, d):
+		# None simulates all of space
+		self.space_sink_dist = d
+		self.update_space_sinks()
+	
+	def update_space_sinks(self):
+		# work out how far every tile is from the nearest structure
+		w, h = self.w, self.h
+		d = self.space_sink_dist
+		dist = array.array("i", [-1])*(w*h)
+		q = []
+		for x0, y0, x1, y1 in self.get_loaded_rects():
+			for y in xrange(y0, y1):
+				for x in xrange(x0, x1):
+					if self.g[y][x].structure:
+						dist[self.get_index(x, y)] = 0
+						q.append((x, y))
+		
+		for x, y in q:
+			nd = dist[self.get_index(x, y)]+1
+			if d != None and nd > d:
+				continue
+			for u,v in DIR_LIST_NSWE:
+				if 0 <= x+u < w and 0 <= y+v < h and dist[self.get_index(x+u, y+v)] == -1:
+					dist[self.get_index(x+u, y+v)] = nd
+					q.append((x+u, y+v))
+		
+		# any space that's getting simulated needs tiles of its own
+		if d == None:
+			self.alloc_all_chunks()
+		for x, y in q:
+			if self.chunk_state[self.get_chunk_index(x, y)] == CHUNK_VOID:
+				self.alloc_chunk(x//WORLD_CHUNK_SIZE, y//WORLD_CHUNK_SIZE)
+		
+		for x0, y0, x1, y1 in self.get_loaded_rects(border=False):
+			for y in xrange(y0, y1):
+				for x in xrange(x0, x1):
+					tc = self.g[y][x].tile_type
+					deep = d != None and dist[self.get_index(x, y)] == -1 and not self.is_near_unloaded(x, y)
+					if tc == tile.SpaceTile and deep:
+						self.g[y][x] = tile.DeepSpaceTile(self, x, y)
+					elif tc == tile.DeepSpaceTile and not deep:
+						self.g[y][x] = tile.SpaceTile(self, x, y)
+		
+		if self.grid_engine != None:
+			self.grid_engine.invalidate()
+		self.zones.build()
+	
+	def is_near_structure(self, x, y):
+		d = self.space_sink_dist
+		for v in xrange(-d, d+1, 1):
+			for u in xrange(-(d-abs(v)), d-abs(v)+1, 1):
+				if 0 <= x+u < self.w and 0 <= y+v < self.h and self.g[y+v][x+u].structure:
+					return True
+		
+		return False
+	
+	def is_near_unloaded(self, x, y):
+		# whatever hasn't loaded yet might well be a structure,
+		# so space within reach of it can't be written off as deep space yet.
+		# the space around a chunk gets looked at again once it loads.
+		d = self.space_sink_dist
+		for cy in xrange(max(0, y-d)//WORLD_CHUNK_SIZE, min(self.h-1, y+d)//WORLD_CHUNK_SIZE+1):
+			for cx in xrange(max(0, x-d)//WORLD_CHUNK_SIZE, min(self.w-1, x+d)//WORLD_CHUNK_SIZE+1):
+				if self.chunk_state[cy*self.chunks_w+cx] == CHUNK_UNLOADED:
+					return True
+		
+		return False
+	
+	def update_space_sinks_in(self, x0, y0, x1, y1):
+		# everything within reach of the rectangle x0,y0-x1,y1
+		d = self.space_sink_dist
+		if d == None:
+			return
+		
+		for py in xrange(max(1, y0-d), min(self.h-1, y1+d)):
+			for px in xrange(max(1, x0-d), min(self.w-1, x1+d)):
+				tc = self.g[py][px].tile_type
+				if tc == tile.SpaceTile and not self.is_near_unloaded(px, py) and not self.is_near_structure(px, py):
+					self.replace_tile(px, py, tile.DeepSpaceTile(self, px, py))
+				elif tc in (tile.DeepSpaceTile, tile.VoidTile) and self.is_near_structure(px, py):
+					self.replace_tile(px, py, tile.SpaceTile(self, px, py))
+	
+	def update_space_sinks_near(self, x, y):
+		# only the space within reach of x,y can have changed
+		d = self.space_sink_dist
+		if d == None:
+			return
+		
+		for v in xrange(-d, d+1, 1):
+			for u in xrange(-(d-abs(v)), d-abs(v)+1, 1):
+				px, py = x+u, y+v
+				if px <= 0 or px >= self.w-1 or py <= 0 or py >= self.h-1:
+					continue
+				
+				tc = self.g[py][px].tile_type
+				if tc == tile.SpaceTile and not self.is_near_unloaded(px, py) and not self.is_near_structure(px, py):
+					self.replace_tile(px, py, tile.DeepSpaceTile(self, px, py))
+				elif tc in (tile.DeepSpaceTile, tile.VoidTile) and self.is_near_structure(px, py):
+					self.replace_tile(px, py, tile.SpaceTile(self, px, py))
+	
+	def put_tile(self, x, y, t):
+		self.get_tile(x, y)
+		self.replace_tile(x, y, t)
+		self.mark_dirty(x, y)
+		self.update_space_sinks_near(x, y)
+	
+	def replace_tile(self, x, y, t):
+		self.alloc_chunk(x//WORLD_CHUNK_SIZE, y//WORLD_CHUNK_SIZE)
+		self.g[y][x] = t
+		
+		self.invalidate_tile(x, y)
+		self.disturb_atmos(x, y)
+	
+	def get_neighbours(self, x, y):
+		# the tiles around x,y in DIR_LIST_NSWE order, which can't be off the map.
+		# they're only ever looked up, so there's nothing on the tiles to keep up to date.
+		g = self.g
+		row = g[y]
+		return g[y-1][x], g[y+1][x], row[x-1], row[x+1]
+	
+	def get_tile_type(self, tc):
+		# tc bound to this world, which is what its tiles here actually are
+		tc = tc.tile_type
+		btc = self.tile_types.get(tc)
+		if btc == None:
+			btc = self.tile_types[tc] = tc.bind(self)
+		return btc
+	
+	def invalidate_tile(self, x, y):
+		# something about this tile other than its gas changed
+		if self.grid_engine != None:
+			self.grid_engine.invalidate_rect(x, y, x+1, y+1)
+		
+		i = self.get_index(x, y)
+		self.invalidate_stress(i)
+		self.zones.retile(i)
+	
+	def get_index(self, x, y):
+		return y*self.w+x
+	
+	def reset_atmos(self, i, defaults):
+		# the arrays don't hold anything for chunks without tiles of their own,
+		# so a tile being made for one of those gets it some first
+		x, y = i%self.w, i//self.w
+		if self.chunk_state[self.get_chunk_index(x, y)] != CHUNK_ALLOCATED:
+			self.get_tile(x, y)
+			self.alloc_chunk(x//WORLD_CHUNK_SIZE, y//WORLD_CHUNK_SIZE)
+		
+		for k, v in defaults.iteritems():
+			getattr(self, k)[i] = v
+		
+		self.invalidate_stress(i)
+	
+	def get_atmos_run(self, name, x0, y, x1):
+		# atmos field name of the tiles along row y from x0 to x1, all in the one chunk.
+		# the shared tiles keep nothing in the arrays, they say what's there themselves.
+		if self.chunk_state[self.get_chunk_index(x0, y)] == CHUNK_ALLOCATED:
+			return getattr(self, name)[self.get_index(x0, y):self.get_index(x1, y)]
+		
+		return [getattr(t, name) for t in self.g[y][x0:x1]]
+	
+	def cache_stress(self, i, f, pmax):
+		self.atmos_cond[i] = f
+		self.atmos_cond_max[i] = pmax
+	
+	def invalidate_stress(self, i):
+		self.atmos_cond_max[i] = float("-inf")
+	
+	def set_view(self, x, y, w, h):
+		# whatever was deferred outside the old view never got queued,
+		# so the new one needs a repaint_on
+		self.view = (x, y, w, h)
+		self.draw_queue = []
+		self.draw_set = set()
+		self.view_glyphs = None
+	
+	def in_view(self, x, y):
+		v = self.view
+		return v == None or (v[0] <= x < v[0]+v[2] and v[1] <= y < v[1]+v[3])
+	
+	def get_view_rect(self):
+		# x0,y0,x1,y1 of the view
+		if self.view == None:
+			return (0, 0, self.w, self.h)
+		
+		x, y, w, h = self.view
+		return (x, y, x+w, y+h)
 	
 	def defer_draw_tile(self, x, y):
-		if (x,y) not in self.draw_set:
+		# anything out of view doesn't need drawing until it comes into view
+		if (x,y) not in self.draw_set and self.in_view(x, y):
 			self.draw_queue.append((x,y))
 			self.draw_set.add((x,y))
 	
 	def repaint_pres_on(self, ws):
-		for y in xrange(self.h):
-			for x in xrange(self.w):
-				t = self.g[y][x]
-				self.draw_tile_pres(ws, x, y)
+		for x0, y0, x1, y1 in self.get_loaded_rects(within=self.get_view_rect()):
+			for y in xrange(y0, y1):
+				row = self.g[y]
+				for x in xrange(x0, x1):
+					self.put_glyph(ws, x, y, self.get_pres_glyph(row[x]))
 	
-	def draw_tile_pres(self, ws, x, y):
-		t = self.g[y][x]
-		gsh, gsw = ws.getmaxyx()
+	def get_pres_glyph(self, t):
+		tab = self.pres_glyph_tables.get(t.tile_type)
+		if tab == None:
+			tab = common.get_twogradient_table(0.0, t.pres_tol_min, t.pres_tol_max)
+			self.pres_glyph_tables[t.tile_type] = tab
 		
-		assert x >= 0
-		assert y >= 0
-		assert x < self.w
-		assert y < self.h
-		assert x < gsw
-		assert y < gsh
+		return common.get_table_glyph(t.get_pres((0,0)), tab)
+	
+	def draw_tile_pres(self, ws, x, y):
+		if not self.in_view(x, y):
+			return
 		
-		ws.addstr(y,x,common.get_twogradient(t.get_pres((0,0)), 0.0, t.pres_tol_min, t.pres_tol_max))
+		self.put_glyph(ws, x, y, self.get_pres_glyph(self.g[y][x]))
 	
 	def repaint_on(self, ws):
+		# whoever's repainting may have wiped ws, so forget what's on it
+		self.view_glyphs = None
+		
 		if self.pressure_view:
 			return self.repaint_pres_on(ws)
 		
-		for y in xrange(self.h):
-			for x in xrange(self.w):
-				self.draw_tile(ws, x, y)
+		for x0, y0, x1, y1 in self.get_loaded_rects(within=self.get_view_rect()):
+			for y in xrange(y0, y1):
+				for x in xrange(x0, x1):
+					self.draw_tile(ws, x, y)
 	
 	def draw_tile(self, ws, x, y):
 		if self.pressure_view:
 			return self.draw_tile_pres(ws, x, y)
+		if not self.in_view(x, y):
+			return
 		
 		t = self.g[y][x]
+		assert len(t.get_ch()) == 1
+		self.put_glyph(ws, x, y, t.get_ch())
+	
+	def put_glyph(self, ws, x, y, ch):
+		# only cells whose glyph actually changed get written out
+		vx, vy, vx1, vy1 = self.get_view_rect()
+		if self.view_glyphs == None:
+			self.view_glyphs = bytearray((vx1-vx)*(vy1-vy))
+		k = (y-vy)*(vx1-vx) + (x-vx)
+		if self.view_glyphs[k] == ord(ch):
+			return
+		
 		gsh, gsw = ws.getmaxyx()
 		
-		assert len(t.get_ch()) == 1
 		assert x >= 0
 		assert y >= 0
 		assert x < self.w
 		assert y < self.h
-		assert x < gsw
-		assert y < gsh
+		assert x-vx < gsw
+		assert y-vy < gsh
 		
 		try:
-			ws.addstr(y,x,t.get_ch())
+			ws.addstr(y-vy,x-vx,ch)
 		except Exception:
-			assert False, "%i %i %s [%i,%i]" % (y,x,t.get_ch(),gsw,gsh)
+			assert False, "%i %i %s [%i,%i]" % (y,x,ch,gsw,gsh)
+		self.view_glyphs[k] = ord(ch)
+		self.view_dirty = True
 	
 	def get_atmos_vec(self, x, y):
 		if x <= 0 or x >= self.w-1 or y <= 0 or y >= self.h-1:
@@ -173,18 +786,64 @@ class GameWorld:
 	def get_size(self):
 		return self.w, self.h
 	
-	def enqueue_atmos_update(self, x, y):
-		# don't enqueue new atmos updates!
-		if (x,y) in self.atmos_set:
+	def enqueue_atmos_update(self, x, y, rekey=False):
+		# the border never updates, and has no neighbours on the outside
+		if x <= 0 or x >= self.w-1 or y <= 0 or y >= self.h-1:
+			return
+		
+		queued = (x,y) in self.atmos_queue
+		if queued and not rekey:
+			# the atmos update requeues everything around every tile it updates.
+			# working out a new delta for those costs more than updating them
+			# a bit early or late, they get a fresh one once they're updated.
+			return
+		
+		# settled zones are uniform, nothing to do until they get woken up
+		i = self.get_index(x, y)
+		if self.zones.is_settled(i):
 			return
 		
 		t = self.g[y][x]
-		tn, ts, tw, te = (self.g[y+v][x+u] for u,v in ((0,-1),(0,1),(-1,0),(1,0)))
-		tp = t.get_atmos_delta(tn, ts, tw, te)
+		if t.atmos_sink or t.atmos_frozen:
+			tp = 0.0
+		else:
+			tp = t.get_atmos_delta()
 		
-		if tp > ATMOS_MIN_DELTA:
-			heapq.heappush(self.atmos_queue, (-(tp-self.ftime*ATMOS_UPDATES_FRAME_FACTOR), (x,y)))
-			self.atmos_set.add((x,y))
+		if tp <= ATMOS_MIN_DELTA:
+			if queued:
+				# it's been evened out or replaced with something that can't flow
+				self.atmos_queue.remove((x,y))
+				self.forget_atmos_delta(x, y)
+				self.zones.on_dequeued(i)
+			return
+		
+		prio = -(tp-self.ftime*ATMOS_UPDATES_FRAME_FACTOR)
+		if queued:
+			# move it up if it's got more urgent, but never back,
+			# it keeps however long it's already been waiting
+			self.atmos_residual += tp-self.atmos_delta[(x,y)]
+			self.atmos_delta[(x,y)] = tp
+			self.atmos_queue.decrease((x,y), prio)
+		else:
+			self.atmos_residual += tp
+			self.atmos_delta[(x,y)] = tp
+			self.atmos_queue.push((x,y), prio)
+			self.zones.on_queued(i)
+	
+	def disturb_atmos(self, x, y):
+		# something other than the atmos update has just changed the gas at x,y,
+		# or how it flows. whatever's already queued there and next to it
+		# might need updating sooner than it was queued for.
+		self.enqueue_atmos_update(x, y, True)
+		for u,v in DIR_LIST_NSWE:
+			if (x+u,y+v) in self.atmos_queue:
+				self.enqueue_atmos_update(x+u, y+v, True)
+	
+	def clear_atmos_queue(self):
+		self.atmos_queue.clear()
+		self.atmos_delta = {}
+		self.atmos_residual = 0.0
+		self.zones.reset_queued()
 	
 	def flush_draw_queue(self, ws):
 		for (x,y) in self.draw_queue:
@@ -193,37 +852,164 @@ class GameWorld:
 		self.draw_queue = []
 		self.draw_set = set()
 	
-	def tick(self, ws):
+	def get_atmos_stats(self):
+		# (updates done last tick, how long they took, what's still queued)
+		return self.atmos_tick_updates, self.atmos_tick_ms, len(self.atmos_queue)
+	
+	def get_atmos_residual(self):
+		return self.atmos_residual
+	
+	def forget_atmos_delta(self, x, y):
+		# (x,y) has just come off the queue
+		self.atmos_residual -= self.atmos_delta.pop((x,y))
+		if not self.atmos_delta:
+			self.atmos_residual = 0.0 # don't let rounding errors pile up
+	
+	def update_atmos_at(self, x, y):
+		self.zones.on_dequeued(self.get_index(x, y))
+		self.g[y][x].update_atmos_pres()
+		self.enqueue_atmos_update(x, y)
+		if self.pressure_view:
+			self.defer_draw_tile(x,y)
+	
+	def tick(self, ws, budget_ms=None):
+		if self.atmos_engine != "tile":
+			return self.tick_grid(ws)
+		
+		if budget_ms == None:
+			budget_ms = self.atmos_budget_ms
+		
+		self.ftime += 1
+		t0 = time.time()
+		
+		if budget_ms == None:
+			l = self.atmos_queue.pop_many(ATMOS_UPDATES_PER_TICK)
+			for _,(x,y) in l:
+				self.forget_atmos_delta(x, y)
+			for _,(x,y) in l:
+				self.update_atmos_at(x, y)
+			n = len(l)
+		else:
+			# keep taking the most urgent tile until we run out of time,
+			# whatever's left over just waits for the next tick.
+			# same as the fixed count, each tile gets updated once a tick at most,
+			# anything requeued after its update here is put back for the next one.
+			deadline = t0 + budget_ms/1000.0
+			n = 0
+			done = set()
+			held = []
+			while self.atmos_queue and (n == 0 or time.time() < deadline):
+				prio,(x,y) = self.atmos_queue.pop()
+				if (x,y) in done:
+					held.append((prio,(x,y)))
+					continue
+				
+				done.add((x,y))
+				self.forget_atmos_delta(x, y)
+				self.update_atmos_at(x, y)
+				n += 1
+			
+			for prio,(x,y) in held:
+				self.atmos_queue.push((x,y), prio)
+		
+		self.zones.settle_pending()
+		self.atmos_tick_updates = n
+		self.atmos_tick_ms = (time.time()-t0)*1000.0
+		self.flush_draw_queue(ws)
+	
+	def tick_grid(self, ws):
 		self.ftime += 1
-		l = [heapq.heappop(self.atmos_queue)
-			for i in xrange(min(len(self.atmos_queue),ATMOS_UPDATES_PER_TICK))]
+		t0 = time.time()
+		touched = self.grid_engine.tick()
+		self.atmos_tick_updates = int(touched.sum())
+		self.atmos_tick_ms = (time.time()-t0)*1000.0
 		
-		for _,(x,y) in l:
-			self.atmos_set.remove((x,y))
+		# the per-tile updates for pumps will have queued stuff up
+		self.clear_atmos_queue()
+		self.atmos_residual = self.grid_engine.residual
 		
-		for _,(x,y) in l:
-			t = self.g[y][x]
-			tn, ts, tw, te = (self.g[y+v][x+u] for u,v in ((0,-1),(0,1),(-1,0),(1,0)))
-			t.update_atmos_pres(tn, ts, tw, te)
+		# gas moved without going through add_pres
+		self.zones.wake_all()
+		
+		if self.pressure_view:
+			ys, xs = touched.nonzero()
+			for x, y in zip(xs, ys):
+				self.defer_draw_tile(x, y)
+		
+		self.flush_draw_queue(ws)
+	
+	def solve_atmos_zone(self, x, y, ticks=None):
+		# returns False if nothing got solved, see ZoneSolver.solve
+		i = self.get_index(x, y)
+		zid = self.zones.zone_of[i]
+		if zid == 0 or not atmosgrid.available():
+			return False
+		
+		if self.zone_solver == None:
+			self.zone_solver = atmosgrid.ZoneSolver(self)
+		
+		z = self.zones.zones[zid]
+		if not self.zone_solver.solve(z.tiles, ticks):
+			return False
+		
+		self.zones.wake(i)
+		for i in z.tiles:
+			x, y = i%self.w, i//self.w
 			self.enqueue_atmos_update(x, y)
 			if self.pressure_view:
-				self.defer_draw_tile(x,y)
+				self.defer_draw_tile(x, y)
 		
-		self.flush_draw_queue(ws)
+		return True
+	
+	def solve_atmos_zones(self):
+		for z in self.zones.zones.values():
+			i = iter(z.tiles).next()
+			self.solve_atmos_zone(i%self.w, i//self.w)
+	
+	def on_zone_opened(self, x, y):
+		# a door or valve at (x,y) has just opened, this invalidates it.
+		# if it joins up two big zones, skip over the slow part of them evening out.
+		# anything small sorts itself out quickly enough on its own.
+		i = self.get_index(x, y)
+		sides = set(self.zones.zone_of[i+o] for o in self.zones.get_offsets())
+		sides.discard(0)
+		sizes = sorted(len(self.zones.zones[zid].tiles) for zid in sides)
+		
+		self.invalidate_tile(x, y)
+		if len(sizes) >= 2 and sizes[-2] >= ATMOS_SOLVE_MIN_TILES:
+			self.solve_atmos_zone(x, y, ATMOS_SOLVE_OPEN_TICKS)
 	
 	def tick_full(self, ws):
+		if self.atmos_presolve:
+			self.atmos_presolve = False
+			self.solve_atmos_zones()
+		
+		if self.atmos_engine != "tile":
+			return self.tick_grid(ws)
+		
 		# clear queues + sets
-		self.atmos_queue = []
-		self.atmos_set = set()
+		self.clear_atmos_queue()
 		self.draw_queue = []
 		self.draw_set = set()
 		
 		# enqueue all atmos tiles where necessary
-		for y in xrange(1, self.h-1, 1):
-			for x in xrange(1, self.w-1, 1):
-				self.enqueue_atmos_update(x, y)
-				self.defer_draw_tile(x, y)
+		for x0, y0, x1, y1 in self.get_loaded_rects(border=False):
+			for y in xrange(y0, y1):
+				for x in xrange(x0, x1):
+					self.enqueue_atmos_update(x, y)
+					self.defer_draw_tile(x, y)
 		
 		# now do regular tick
 		self.tick(ws)
+	
+	def settle(self, ws, max_ticks=ATMOS_SETTLE_MAX_TICKS, residual=ATMOS_SETTLE_RESIDUAL):
+		# tick until the atmos has settled down, or we give up.
+		# returns how many ticks it took.
+		self.tick_full(ws)
+		n = 1
+		while n < max_ticks and self.atmos_residual >= residual:
+			self.tick(ws)
+			n += 1
+		
+		return n
 
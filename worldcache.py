@@ -0,0 +1,134 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import os, hashlib
+
+from const import *
+import world, worldfile
+
+# a cache entry is a world saved as v3, which can be mapped and loaded lazily
+# and is compressed a chunk at a time, plus a .key file saying which
+# world file (and journal) it came from.
+# entries are named after the path of that world file, so there's one per world.
+# bump this whenever what gets written for the same world would change.
+CACHE_VERSION = 2
+
+class WorldCache:
+	# keeps worlds around after they've been parsed once,
+	# so the next load_new_world of the same file can skip the parsing
+	def __init__(self, path, max_bytes=WORLD_CACHE_MAX_BYTES, max_entries=WORLD_CACHE_MAX_ENTRIES):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.max_entries = max_entries
+	
+	def get_entry_name(self, fname):
+		return os.path.join(self.path, hashlib.sha1(os.path.abspath(fname)).hexdigest())
+	
+	def get_key(self, fname):
+		# path, size and mtime of the world file, plus a hash of it and its journal
+		st = os.stat(fname)
+		h = hashlib.sha1()
+		for name in (fname, worldfile.get_journal_name(fname)):
+			if os.path.exists(name):
+				fp = open(name, "rb")
+				try:
+					for data in iter(lambda: fp.read(1<<16), ""):
+						h.update(data)
+				finally:
+					fp.close()
+			h.update("\x00")
+		
+		return repr((CACHE_VERSION, os.path.abspath(fname), st.st_size, st.st_mtime, h.hexdigest()))
+	
+	def load(self, fname, lazy=False):
+		# returns None if there's nothing cached for fname as it is now
+		ename = self.get_entry_name(fname)
+		try:
+			fp = open(ename + ".key", "rb")
+			try:
+				key = fp.read()
+			finally:
+				fp.close()
+			
+			if key != self.get_key(fname):
+				return None
+			
+			wd = world.open_world(ename + ".wld", lazy)
+			os.utime(ename + ".wld", None) # it's just been used, see evict
+			return wd
+		except (EnvironmentError, world.GameWorld.WorldFormatException):
+			return None
+	
+	def store(self, fname, wd):
+		# the cache only ever makes things faster, so if it can't be written to,
+		# nothing else needs to know about it
+		ename = self.get_entry_name(fname)
+		try:
+			key = self.get_key(fname)
+			if not os.path.isdir(self.path):
+				os.makedirs(self.path)
+			# a v3 world's chunks get copied across as they are, see write_world
+			worldfile.write_world(wd, ename + ".wld").close()
+			fp = open(ename + ".key.tmp", "wb")
+			fp.write(key)
+			fp.close()
+			os.rename(ename + ".key.tmp", ename + ".key")
+			self.evict()
+		except EnvironmentError:
+			pass
+	
+	def evict(self):
+		# drops the least recently used entries until it's all within the limits
+		entries = []
+		for name in os.listdir(self.path):
+			if name.endswith(".wld"):
+				ename = os.path.join(self.path, name[:-4])
+				try:
+					st = os.stat(ename + ".wld")
+				except OSError:
+					continue # something else just got rid of it
+				size = st.st_size
+				if os.path.exists(ename + ".key"):
+					size += os.path.getsize(ename + ".key")
+				entries.append((st.st_mtime, size, ename))
+		
+		entries.sort()
+		total = sum(size for mtime, size, ename in entries)
+		while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+			mtime, size, ename = entries.pop(0)
+			total -= size
+			for name in (ename + ".key", ename + ".wld"):
+				if os.path.exists(name):
+					os.remove(name)
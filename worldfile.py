@@ -0,0 +1,589 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import os, sys, struct, array, mmap, bisect, zlib, cStringIO
+
+from const import *
+import tile
+import world
+
+MAGIC_V1 = "SS3-14\x1A\x01"
+MAGIC_V2 = "SS3-14\x1A\x02"
+MAGIC_V3 = "SS3-14\x1A\x03"
+MAGIC_JOURNAL = "SS3-14J\x01"
+
+# v2 is one section per field, each covering the whole map in row order,
+# then the save_extra bytes of every tile that has any, plus where to find them.
+# every section is little-endian and prefixed by its length in bytes.
+V2_SECTIONS = (
+	[("type", "h"), ("ch", "c"), ("col", "B"), ("flags", "B")]
+	+ [(k, "f") for k in tile.ATMOS_FIELDS]
+	+ [("extra", "c"), ("extra_index", "i"), ("extra_offsets", "I")]
+)
+V2_TILE_SECTIONS = 4+len(tile.ATMOS_FIELDS)
+
+# v3 cuts the map into chunks, each one holding the v2 tile sections
+# for just its own tiles (plus their extra bytes), compressed with zlib.
+# after the magic: w, h, chunk size, then an index with the offset, length
+# and crc32 of the uncompressed data for every chunk, in row order.
+V3_CHUNK_SECTIONS = V2_SECTIONS[:V2_TILE_SECTIONS+1]
+
+# a journal sits next to its world file, and holds tiles that changed since
+# the world file was written. after the magic: w, h, then one record per tile,
+# each one its index, type id, how long the rest is, then whatever Tile.save writes.
+# it gets replayed on load, and goes away whenever the world file gets rewritten.
+
+TILE_ID_TYPES = dict((i, tc) for tc, i in tile.TILE_TYPE_IDS.iteritems())
+
+def format_error(msg):
+	return world.GameWorld.WorldFormatException(msg)
+
+def read_world(fname):
+	fp = open(fname, "rb")
+	try:
+		magic = fp.read(8)
+		if magic == MAGIC_V1:
+			return read_world_v1(fp)
+		elif magic == MAGIC_V2:
+			return read_world_v2(fp)
+		elif magic == MAGIC_V3:
+			return read_world_v3(fp)
+		else:
+			raise format_error("not an SS3-14 world")
+	finally:
+		fp.close()
+
+def read_world_v1(fp):
+	# one tile after another, each one reading its own fields
+	w, h = struct.unpack("<HH", fp.read(4))
+	wd = world.GameWorld(w, h)
+	
+	for y in xrange(h):
+		wd.claim_tiles(0, y, w)
+		for x in xrange(w):
+			tt, = struct.unpack("<h",fp.read(2))
+			tc = tile.BorderTile if tt == -1 else tile.TILE_TYPES[tt]
+			t = tc(wd, x, y)
+			t.load(fp)
+			wd.g[y][x] = t
+	
+	return wd
+
+def read_world_v2(fp):
+	w, h = struct.unpack("<HH", fp.read(4))
+	n = w*h
+	wd = world.GameWorld(w, h)
+	
+	cols = [read_section(fp, tc, n) for name, tc in V2_SECTIONS[:V2_TILE_SECTIONS]]
+	extra = cStringIO.StringIO(read_section(fp, "c").tostring())
+	
+	# the extra bytes are in tile order, so they can just be read straight through
+	for y in xrange(h):
+		i0 = y*w
+		place_tiles(wd, 0, y, [a[i0:i0+w] for a in cols], extra)
+	
+	return wd
+
+def read_world_v3(fp):
+	src = ChunkedWorldFile(fp)
+	wd = world.GameWorld(src.w, src.h)
+	for cy in xrange(src.chunks_h):
+		for cx in xrange(src.chunks_w):
+			x0, y0 = cx*src.chunk_size, cy*src.chunk_size
+			x1, y1 = min(src.w, x0+src.chunk_size), min(src.h, y0+src.chunk_size)
+			decode_chunk(wd, src.get_chunk(src.chunks_w*cy+cx), x0, y0, x1, y1)
+	
+	# if the chunk grid matches, the next save can reuse what didn't change
+	if src.chunk_size == WORLD_CHUNK_SIZE:
+		wd.source = src
+	else:
+		src.close()
+	
+	return wd
+
+def get_journal_name(fname):
+	return fname + ".journal"
+
+def append_journal(wd, fname, indices):
+	jname = get_journal_name(fname)
+	new = not os.path.exists(jname)
+	fp = open(jname, "ab")
+	if new:
+		fp.write(MAGIC_JOURNAL)
+		fp.write(struct.pack("<HH", wd.w, wd.h))
+	
+	# build it all up first, so it goes out in one write
+	out = cStringIO.StringIO()
+	rec = cStringIO.StringIO()
+	for i in indices:
+		t = wd.g[i//wd.w][i%wd.w]
+		rec.seek(0)
+		rec.truncate()
+		t.save(rec)
+		out.write(struct.pack("<IhH", i, tile.TILE_TYPE_IDS[t.save_type or t.tile_type], rec.tell()))
+		out.write(rec.getvalue())
+	
+	fp.write(out.getvalue())
+	fp.close()
+
+def replay_journal(wd, fname):
+	jname = get_journal_name(fname)
+	if not os.path.exists(jname):
+		return
+	
+	fp = open(jname, "rb")
+	try:
+		if fp.read(8) != MAGIC_JOURNAL or struct.unpack("<HH", fp.read(4)) != (wd.w, wd.h):
+			raise format_error("journal doesn't belong to this world")
+		
+		while True:
+			head = fp.read(8)
+			i, tt, l = struct.unpack("<IhH", head) if len(head) == 8 else (0, 0, 0)
+			rec = fp.read(l)
+			if len(head) != 8 or len(rec) != l:
+				break # anything cut off partway through never got saved
+			
+			tc = TILE_ID_TYPES.get(tt)
+			if tc == None or i >= wd.w*wd.h:
+				raise format_error("bad record in journal")
+			
+			x, y = i%wd.w, i//wd.w
+			wd.get_tile(x, y)
+			t = tc(wd, x, y)
+			t.load(cStringIO.StringIO(rec))
+			wd.put_tile(x, y, t)
+	finally:
+		fp.close()
+
+def remove_journal(fname):
+	jname = get_journal_name(fname)
+	if os.path.exists(jname):
+		os.remove(jname)
+
+def place_tiles(wd, x0, y, cols, extra):
+	# builds a run of tiles along row y from the v2 fields in cols,
+	# reading their extra bytes from extra
+	tts, chs, cls, flags = cols[:4]
+	wd.claim_tiles(x0, y, x0+len(tts))
+	row = wd.g[y]
+	for k in xrange(len(tts)):
+		tc = TILE_ID_TYPES.get(tts[k])
+		if tc == None:
+			raise format_error("unknown tile type %i" % tts[k])
+		
+		t = tc(wd, x0+k, y)
+		if chs[k] != t.ch:
+			t.ch = chs[k]
+		if cls[k] != t.col:
+			t.col = cls[k]
+		t.set_flags(flags[k])
+		t.load_extra(extra)
+		row[x0+k] = t
+	
+	# the tiles put their defaults in, now overwrite them all in one go
+	i0 = wd.get_index(x0, y)
+	for name, a in zip(tile.ATMOS_FIELDS, cols[4:]):
+		getattr(wd, name)[i0:i0+len(a)] = array.array("d", a)
+
+def write_world(wd, fname):
+	# writes v3, and returns the new file mapped for the world to use as its source.
+	# chunks that haven't changed since they were last loaded or saved
+	# get copied across from the old source without being recompressed.
+	src = wd.source
+	if not isinstance(src, ChunkedWorldFile):
+		src = None
+	
+	nc = wd.chunks_w*wd.chunks_h
+	tmpname = fname + ".tmp"
+	fp = open(tmpname, "wb")
+	fp.write(MAGIC_V3)
+	fp.write(struct.pack("<HHH", wd.w, wd.h, WORLD_CHUNK_SIZE))
+	fp.write("\x00"*(12*nc))
+	
+	index = []
+	for cy in xrange(wd.chunks_h):
+		for cx in xrange(wd.chunks_w):
+			k = cy*wd.chunks_w+cx
+			if wd.chunk_state[k] == CHUNK_UNLOADED and src != None:
+				blob, crc = src.get_blob(k), src.crcs[k]
+			else:
+				# the chunk might only be in some other kind of file
+				wd.load_chunk(cx, cy)
+				raw = encode_chunk(wd, *wd.get_chunk_rect(cx, cy))
+				crc = zlib.crc32(raw) & 0xFFFFFFFF
+				if src != None and src.crcs[k] == crc:
+					blob = src.get_blob(k)
+				else:
+					blob = zlib.compress(raw)
+			
+			index.extend([fp.tell(), len(blob), crc])
+			fp.write(blob)
+	
+	fp.seek(len(MAGIC_V3)+6)
+	fp.write(struct.pack("<%iI" % len(index), *index))
+	fp.close()
+	
+	os.rename(tmpname, fname)
+	remove_journal(fname)
+	
+	fp = open(fname, "rb")
+	fp.read(8)
+	return ChunkedWorldFile(fp)
+
+def encode_chunk(wd, x0, y0, x1, y1):
+	tts = array.array("h")
+	chs = array.array("c")
+	cls = array.array("B")
+	flags = array.array("B")
+	atmos = [array.array("f") for k in tile.ATMOS_FIELDS]
+	extra = cStringIO.StringIO()
+	for y in xrange(y0, y1):
+		for t in wd.g[y][x0:x1]:
+			tts.append(tile.TILE_TYPE_IDS[t.save_type or t.tile_type])
+			chs.append(t.ch)
+			cls.append(t.col)
+			flags.append(t.get_flags())
+			t.save_extra(extra)
+		
+		for k, a in zip(tile.ATMOS_FIELDS, atmos):
+			a.extend(array.array("f", wd.get_atmos_run(k, x0, y, x1)))
+	
+	fp = cStringIO.StringIO()
+	for a in [tts, chs, cls, flags]+atmos:
+		write_section(fp, a)
+	write_section(fp, array.array("c", extra.getvalue()))
+	
+	return fp.getvalue()
+
+def decode_chunk(wd, raw, x0, y0, x1, y1):
+	fp = cStringIO.StringIO(raw)
+	n = (x1-x0)*(y1-y0)
+	cols = [read_section(fp, tc, n) for name, tc in V3_CHUNK_SECTIONS[:-1]]
+	extra = cStringIO.StringIO(read_section(fp, "c").tostring())
+	
+	rw = x1-x0
+	for y in xrange(y0, y1):
+		k = (y-y0)*rw
+		place_tiles(wd, x0, y, [a[k:k+rw] for a in cols], extra)
+
+def write_world_v2(wd, fname):
+	tts = array.array("h")
+	chs = array.array("c")
+	cls = array.array("B")
+	flags = array.array("B")
+	extra = cStringIO.StringIO()
+	extra_index = array.array("i")
+	extra_offsets = array.array("I")
+	atmos = [array.array("f") for k in tile.ATMOS_FIELDS]
+	i = 0
+	for y, row in enumerate(wd.g):
+		for x0 in xrange(0, wd.w, WORLD_CHUNK_SIZE):
+			x1 = min(wd.w, x0+WORLD_CHUNK_SIZE)
+			for k, a in zip(tile.ATMOS_FIELDS, atmos):
+				a.extend(array.array("f", wd.get_atmos_run(k, x0, y, x1)))
+		
+		for t in row:
+			tts.append(tile.TILE_TYPE_IDS[t.save_type or t.tile_type])
+			chs.append(t.ch)
+			cls.append(t.col)
+			flags.append(t.get_flags())
+			
+			pos = extra.tell()
+			t.save_extra(extra)
+			if extra.tell() != pos:
+				extra_index.append(i)
+				extra_offsets.append(pos)
+			i += 1
+	extra_offsets.append(extra.tell())
+	
+	fp = open(fname, "wb")
+	fp.write(MAGIC_V2)
+	fp.write(struct.pack("<HH", wd.w, wd.h))
+	
+	for a in [tts, chs, cls, flags]:
+		write_section(fp, a)
+	for a in atmos:
+		write_section(fp, a)
+	write_section(fp, array.array("c", extra.getvalue()))
+	write_section(fp, extra_index)
+	write_section(fp, extra_offsets)
+	
+	fp.close()
+
+def read_section(fp, typecode, count=None):
+	l, = struct.unpack("<I", fp.read(4))
+	return unpack_section(fp.read(l), l, typecode, count)
+
+def unpack_section(data, l, typecode, count=None):
+	a = array.array(typecode)
+	if len(data) != l or l % a.itemsize != 0 or (count != None and l != count*a.itemsize):
+		raise format_error("bad section in world file")
+	
+	a.fromstring(data)
+	if sys.byteorder != "little":
+		a.byteswap()
+	
+	return a
+
+def write_section(fp, a):
+	if sys.byteorder != "little":
+		a = array.array(a.typecode, a)
+		a.byteswap()
+	
+	data = a.tostring()
+	fp.write(struct.pack("<I", len(data)))
+	fp.write(data)
+
+def map_world(fname):
+	# returns something GameWorld can load chunks from as it needs them,
+	# or None if this file has to be read in one go
+	fp = open(fname, "rb")
+	magic = fp.read(8)
+	if magic == MAGIC_V3:
+		src = ChunkedWorldFile(fp)
+		if src.chunk_size == WORLD_CHUNK_SIZE:
+			return src
+		src.close()
+		return None
+	elif magic != MAGIC_V2:
+		fp.close()
+		return None
+	
+	try:
+		return MappedWorldFile(fp)
+	except MappedWorldFile.NotIndexed:
+		fp.close()
+		return None
+
+def stream_world(fname):
+	# same as map_world, except a v1 world can be read from the start
+	# a bit at a time as well. None if it has to be read in one go.
+	src = map_world(fname)
+	if src != None:
+		return src
+	
+	fp = open(fname, "rb")
+	if fp.read(8) != MAGIC_V1:
+		fp.close()
+		return None
+	
+	return StreamedWorldFile(fp)
+
+class MappedWorldFile:
+	# a v2 world file, memory-mapped so that tiles only get read
+	# as GameWorld.load_chunk asks for them
+	class NotIndexed(Exception):
+		pass
+	
+	def __init__(self, fp):
+		self.fp = fp
+		self.fname = fp.name
+		self.mm = mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+		self.w, self.h = struct.unpack("<HH", mm[8:12])
+		n = self.w*self.h
+		
+		# how far through the file load_tiles has got, more or less
+		self.bytes_read = 12
+		self.total_bytes = len(mm)
+		
+		# just find where everything is
+		self.sections = {}
+		off = 12
+		for name, tc in V2_SECTIONS:
+			if off == len(mm):
+				# written before extras had an index
+				self.close()
+				raise self.NotIndexed()
+			
+			l, = struct.unpack("<I", mm[off:off+4])
+			if off+4+l > len(mm):
+				self.close()
+				raise format_error("truncated world file")
+			
+			self.sections[name] = (off+4, l, tc)
+			off += 4+l
+		
+		for name, tc in V2_SECTIONS[:V2_TILE_SECTIONS]:
+			if self.sections[name][1] != n*array.array(tc).itemsize:
+				self.close()
+				raise format_error("bad section in world file")
+		
+		self.extra_index = self.read_section("extra_index")
+		self.extra_offsets = self.read_section("extra_offsets", len(self.extra_index)+1)
+	
+	def close(self):
+		self.mm.close()
+		self.fp.close()
+	
+	def read_section(self, name, count=None):
+		off, l, tc = self.sections[name]
+		return unpack_section(self.mm[off:off+l], l, tc, count)
+	
+	def read_run(self, name, i0, i1):
+		off, l, tc = self.sections[name]
+		a = array.array(tc)
+		a.fromstring(self.mm[off+i0*a.itemsize:off+i1*a.itemsize])
+		self.bytes_read += (i1-i0)*a.itemsize
+		if sys.byteorder != "little":
+			a.byteswap()
+		
+		return a
+	
+	def load_tiles(self, wd, x0, y0, x1, y1):
+		eoff = self.sections["extra"][0]
+		for y in xrange(y0, y1):
+			i0, i1 = y*self.w+x0, y*self.w+x1
+			cols = [self.read_run(name, i0, i1) for name, tc in V2_SECTIONS[:V2_TILE_SECTIONS]]
+			
+			k0 = bisect.bisect_left(self.extra_index, i0)
+			k1 = bisect.bisect_left(self.extra_index, i1)
+			extra = cStringIO.StringIO(self.mm[eoff+self.extra_offsets[k0]:eoff+self.extra_offsets[k1]])
+			self.bytes_read += self.extra_offsets[k1]-self.extra_offsets[k0]
+			
+			place_tiles(wd, x0, y, cols, extra)
+
+class ChunkedWorldFile:
+	# a v3 world file. chunks only get decompressed when they're asked for.
+	def __init__(self, fp):
+		self.fp = fp
+		self.fname = fp.name
+		self.mm = mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+		self.w, self.h, self.chunk_size = struct.unpack("<HHH", mm[8:14])
+		if self.chunk_size == 0:
+			self.close()
+			raise format_error("bad chunk size in world file")
+		
+		self.chunks_w = (self.w+self.chunk_size-1)//self.chunk_size
+		self.chunks_h = (self.h+self.chunk_size-1)//self.chunk_size
+		nc = self.chunks_w*self.chunks_h
+		if 14+12*nc > len(mm):
+			self.close()
+			raise format_error("truncated world file")
+		
+		# how much of the file has been decompressed so far
+		self.bytes_read = 14+12*nc
+		self.total_bytes = len(mm)
+		
+		index = struct.unpack("<%iI" % (3*nc), mm[14:14+12*nc])
+		self.offsets = index[0::3]
+		self.lengths = index[1::3]
+		self.crcs = index[2::3]
+		if max(o+l for o, l in zip(self.offsets, self.lengths)) > len(mm):
+			self.close()
+			raise format_error("truncated world file")
+	
+	def close(self):
+		self.mm.close()
+		self.fp.close()
+	
+	def get_blob(self, k):
+		return self.mm[self.offsets[k]:self.offsets[k]+self.lengths[k]]
+	
+	def get_chunk(self, k):
+		self.bytes_read += self.lengths[k]
+		try:
+			return zlib.decompress(self.get_blob(k))
+		except zlib.error:
+			raise format_error("bad chunk in world file")
+	
+	def load_tiles(self, wd, x0, y0, x1, y1):
+		k = (y0//self.chunk_size)*self.chunks_w + x0//self.chunk_size
+		decode_chunk(wd, self.get_chunk(k), x0, y0, x1, y1)
+
+class StreamedWorldFile:
+	# a v1 world file, read from the start only as far as GameWorld.load_chunk needs.
+	# each row gets turned into the v2 fields on the way in,
+	# and let go of once every chunk along it has been loaded.
+	def __init__(self, fp):
+		self.fp = fp
+		self.fname = fp.name
+		self.w, self.h = struct.unpack("<HH", fp.read(4))
+		self.bytes_read = fp.tell()
+		self.total_bytes = os.fstat(fp.fileno()).st_size
+		
+		self.next_y = 0
+		self.rows = {}
+		self.loads_left = {}
+		
+		# tiles of each type to read the extra bytes with, which is all it takes
+		# to find out how many there are
+		self.scratch = dict((tt, tc(None, -1, -1)) for tt, tc in TILE_ID_TYPES.iteritems())
+	
+	def close(self):
+		self.fp.close()
+	
+	def read_row(self):
+		fp = self.fp
+		cols = [array.array(tc) for name, tc in V2_SECTIONS[:V2_TILE_SECTIONS]]
+		extra = cStringIO.StringIO()
+		extra_offsets = array.array("I")
+		for x in xrange(self.w):
+			rec = fp.read(29)
+			if len(rec) != 29:
+				raise format_error("truncated world file")
+			
+			# type, then everything Tile.save writes before save_extra
+			v = struct.unpack("<hcBBffffff", rec)
+			if v[0] not in self.scratch:
+				raise format_error("unknown tile type %i" % v[0])
+			for a, f in zip(cols, v):
+				a.append(f)
+			
+			extra_offsets.append(extra.tell())
+			pos = fp.tell()
+			self.scratch[v[0]].load_extra(fp)
+			if fp.tell() != pos:
+				l = fp.tell()-pos
+				fp.seek(pos)
+				extra.write(fp.read(l))
+		extra_offsets.append(extra.tell())
+		
+		self.rows[self.next_y] = (cols, extra.getvalue(), extra_offsets)
+		self.next_y += 1
+		self.bytes_read = fp.tell()
+	
+	def load_tiles(self, wd, x0, y0, x1, y1):
+		while self.next_y < y1:
+			self.read_row()
+		
+		for y in xrange(y0, y1):
+			cols, extra, extra_offsets = self.rows[y]
+			place_tiles(wd, x0, y, [a[x0:x1] for a in cols],
+				cStringIO.StringIO(extra[extra_offsets[x0]:extra_offsets[x1]]))
+			
+			self.loads_left[y] = self.loads_left.get(y, wd.chunks_w)-1
+			if self.loads_left[y] == 0:
+				del self.rows[y]
+				del self.loads_left[y]
@@ -0,0 +1,331 @@
+#!/usr/bin/env python2 --
+# -*- coding: utf-8 -*-
+
+"""
+
+Space Station 3-14
+A Space Station 13 clone written for a real platform
+
+Copyright (C) 2012, Abendsfrühstücken.
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of Abendsfrühstücken nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL ABENDSFRÜHSTÜCKEN BE LIABLE FOR ANY
+DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+
+import collections
+
+from const import *
+import common
+
+class AtmosZone:
+	def __init__(self, zid, tiles):
+		self.zid = zid
+		self.tiles = tiles # set of tile indices
+		self.queued = 0 # how many of our tiles are in the atmos queue
+		self.settled = False
+		
+		# aggregate mixture, only meaningful while settled
+		self.air = 0.0
+		self.plasma = 0.0
+		self.toxins = 0.0
+		self.heat = 0.0
+
+class ZoneMap:
+	# connected regions of tiles that gas can flow through,
+	# bounded by anything with zero flow (walls, closed doors + valves, tanks)
+	#
+	# once a zone has drained out of the atmos queue, it gets flattened
+	# to its mean mixture and marked settled.
+	# the world then doesn't bother evaluating its tiles at all
+	# until something actually adds or removes gas in it.
+	def __init__(self, world):
+		self.world = world
+		self.build()
+	
+	def build(self):
+		w = self.world
+		# the zid of each tile, 0 if it isn't in one
+		self.zone_of = common.lazy_array("i", w.w*w.h)
+		self.zones = {}
+		self.next_zid = 1
+		self.pending = set()
+		
+		for x0, y0, x1, y1 in w.get_loaded_rects(border=False):
+			for y in xrange(y0, y1):
+				for x in xrange(x0, x1):
+					i = w.get_index(x, y)
+					if self.zone_of[i] == 0 and self.is_member(i):
+						self.new_zone(self.flood(i))
+	
+	def is_member(self, i):
+		w = self.world
+		t = w.g[i//w.w][i%w.w]
+		return t.zoned and t.get_pres_flow() > 0.0
+	
+	def is_queued(self, i):
+		w = self.world
+		return (i%w.w, i//w.w) in w.atmos_queue
+	
+	def get_offsets(self):
+		ww = self.world.w
+		return (-ww, ww, -1, 1)
+	
+	def flood(self, i):
+		zone_of = self.zone_of
+		offs = self.get_offsets()
+		tiles = set([i])
+		q = collections.deque([i])
+		while q:
+			j = q.popleft()
+			for o in offs:
+				k = j+o
+				if k not in tiles and zone_of[k] == 0 and self.is_member(k):
+					tiles.add(k)
+					q.append(k)
+		
+		return tiles
+	
+	def new_zone(self, tiles):
+		zid = self.next_zid
+		self.next_zid += 1
+		
+		z = AtmosZone(zid, tiles)
+		for i in tiles:
+			self.zone_of[i] = zid
+		z.queued = sum(1 for i in tiles if self.is_queued(i))
+		
+		self.zones[zid] = z
+		self.pending.add(zid)
+		return z
+	
+	def is_settled(self, i):
+		zid = self.zone_of[i]
+		return zid != 0 and self.zones[zid].settled
+	
+	def wake(self, i):
+		zid = self.zone_of[i]
+		if zid != 0 and zid not in self.pending:
+			self.zones[zid].settled = False
+			self.pending.add(zid)
+	
+	def wake_all(self):
+		for zid, z in self.zones.iteritems():
+			z.settled = False
+			self.pending.add(zid)
+	
+	def on_queued(self, i):
+		zid = self.zone_of[i]
+		if zid != 0:
+			self.zones[zid].queued += 1
+	
+	def on_dequeued(self, i):
+		zid = self.zone_of[i]
+		if zid != 0:
+			self.zones[zid].queued -= 1
+	
+	def reset_queued(self):
+		for z in self.zones.itervalues():
+			z.queued = 0
+	
+	def retile(self, i):
+		# the tile at i changed in a way that might affect connectivity
+		zid = self.zone_of[i]
+		member = self.is_member(i)
+		
+		if member and zid != 0:
+			self.wake(i)
+		elif member:
+			self.join(i)
+		elif zid != 0:
+			self.leave(i)
+	
+	def join(self, i):
+		zl = set(self.zone_of[i+o] for o in self.get_offsets())
+		zl.discard(0)
+		
+		if not zl:
+			self.new_zone(set([i]))
+			return
+		
+		# fold everything into the biggest zone
+		zl = sorted((self.zones[zid] for zid in zl), key=lambda z: len(z.tiles))
+		z = zl.pop()
+		for oz in zl:
+			for j in oz.tiles:
+				self.zone_of[j] = z.zid
+			z.tiles |= oz.tiles
+			z.queued += oz.queued
+			del self.zones[oz.zid]
+			self.pending.discard(oz.zid)
+		
+		z.tiles.add(i)
+		self.zone_of[i] = z.zid
+		if self.is_queued(i):
+			z.queued += 1
+		
+		self.wake(i)
+	
+	def leave(self, i):
+		zid = self.zone_of[i]
+		z = self.zones[zid]
+		z.tiles.remove(i)
+		self.zone_of[i] = 0
+		if self.is_queued(i):
+			z.queued -= 1
+		
+		if not z.tiles:
+			del self.zones[zid]
+			self.pending.discard(zid)
+			return
+		
+		# taking a tile out of a settled zone doesn't unsettle it,
+		# the tile's share of the mixture just goes with it
+		if z.settled:
+			n = float(len(z.tiles))
+			z.air *= n/(n+1.0)
+			z.plasma *= n/(n+1.0)
+			z.toxins *= n/(n+1.0)
+			z.heat *= n/(n+1.0)
+		
+		starts = [i+o for o in self.get_offsets() if self.zone_of[i+o] == zid]
+		if len(starts) > 1 and not self.is_ring_connected(i, zid):
+			self.split(z, starts)
+	
+	def is_ring_connected(self, i, zid):
+		# walk the 8 tiles around i; if every orthogonal neighbour in the zone
+		# sits in one unbroken run, they're still connected around i
+		ww = self.world.w
+		ring = [i-ww, i-ww+1, i+1, i+ww+1, i+ww, i+ww-1, i-1, i-ww-1]
+		inz = [self.zone_of[j] == zid for j in ring]
+		
+		if all(inz):
+			return True
+		
+		# start just after a gap so runs don't wrap around
+		k0 = inz.index(False)
+		runs = 0
+		in_run = False
+		run_has_orth = False
+		for k in xrange(k0, k0+8, 1):
+			k %= 8
+			if inz[k]:
+				in_run = True
+				if k%2 == 0:
+					run_has_orth = True
+			else:
+				if in_run and run_has_orth:
+					runs += 1
+				in_run = False
+				run_has_orth = False
+		if in_run and run_has_orth:
+			runs += 1
+		
+		return runs <= 1
+	
+	def split(self, z, starts):
+		# grow a search from each side at the same pace, merging searches
+		# when they meet. whatever runs dry first has been cut off.
+		zid = z.zid
+		offs = self.get_offsets()
+		owner = {}
+		groups = []
+		for s in starts:
+			if s not in owner:
+				g = [set([s]), collections.deque([s])]
+				owner[s] = g
+				groups.append(g)
+		
+		while len(groups) > 1:
+			for g in groups[:]:
+				if g not in groups or len(groups) == 1:
+					continue
+				
+				seen, q = g
+				if not q:
+					groups.remove(g)
+					nz = self.new_zone(seen)
+					z.tiles -= seen
+					z.queued -= nz.queued
+					if z.settled:
+						self.settle(nz)
+						self.pending.discard(nz.zid)
+						z.air -= nz.air
+						z.plasma -= nz.plasma
+						z.toxins -= nz.toxins
+						z.heat -= nz.heat
+					continue
+				
+				j = q.popleft()
+				for o in offs:
+					k = j+o
+					if self.zone_of[k] != zid:
+						continue
+					og = owner.get(k)
+					if og == None:
+						owner[k] = g
+						seen.add(k)
+						q.append(k)
+					elif og is not g:
+						seen |= og[0]
+						q.extend(og[1])
+						for m in og[0]:
+							owner[m] = g
+						groups.remove(og)
+	
+	def aggregate(self, z):
+		w = self.world
+		z.air = sum(w.pres_lvl_air[i] for i in z.tiles)
+		z.plasma = sum(w.pres_lvl_plasma[i] for i in z.tiles)
+		z.toxins = sum(w.pres_lvl_toxins[i] for i in z.tiles)
+		z.heat = sum(w.heat_lvl[i] for i in z.tiles)
+	
+	def settle(self, z):
+		# with nothing queued, every tile is within ATMOS_MIN_DELTA of its neighbours.
+		# that can still add up to a gradient across a big zone, but the per-tile update
+		# would never get rid of it, so it might as well be evened out here.
+		w = self.world
+		n = float(len(z.tiles))
+		self.aggregate(z)
+		
+		mix = [(w.pres_lvl_air, z.air/n), (w.pres_lvl_plasma, z.plasma/n),
+			(w.pres_lvl_toxins, z.toxins/n), (w.heat_lvl, z.heat/n)]
+		for a, v in mix:
+			if v < ATMOS_MIN_PRESSURE:
+				v = 0.0
+			for i in z.tiles:
+				if a[i] != v:
+					a[i] = v
+					w.dirty_tiles.add(i)
+		
+		self.aggregate(z)
+		z.settled = True
+	
+	def settle_pending(self):
+		for zid in list(self.pending):
+			z = self.zones.get(zid)
+			if z == None:
+				self.pending.discard(zid)
+			elif z.queued <= 0:
+				self.pending.discard(zid)
+				self.settle(z)